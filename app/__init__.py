@@ -3,6 +3,8 @@ import asyncio
 from app.utilities.reporting import ping_uptime_monitor
 from app.utilities.logging import logger
 from app.file_handler import enqueue_new_files
+from app.queue_reaper import reap_queues
+from app import config
 
 
 async def main():
@@ -16,6 +18,11 @@ async def main():
     uptime_heartbeat_coroutine = asyncio.create_task(ping_uptime_monitor())
     tasks.append(uptime_heartbeat_coroutine)
 
+    # Garbage collection of finished and orphaned queues
+    if config.QUEUE_REAPER_ENABLED:
+        queue_reaper_coroutine = asyncio.create_task(reap_queues())
+        tasks.append(queue_reaper_coroutine)
+
     try:
         # Run the tasks indefinitely
         await asyncio.gather(*tasks)
@@ -1,45 +1,161 @@
 from decouple import config
-import pytz
-import boto3
-
-
-PAUSE = config("PAUSE", cast=bool, default=False)
-
-# S3 bucket name
-S3_BUCKET_NAME = config("S3_BUCKET_NAME")
-
-# Polling interval (in seconds) for checking the S3 bucket for new files, pinging uptime monitor, etc.
-POLLING_INTERVAL = config("POLLING_INTERVAL", cast=int)
-
-# Uptime monitor address
-UPTIME_MONITOR = config("UPTIME_MONITOR")
-
-# Database connection
-DATABASE_CONNECTION_STRING = config("DATABASE_CONNECTION_STRING")
-
-# RabbitMQ connection
-RABBITMQ_HOST = config("RABBITMQ_HOST")
-RABBITMQ_DEFAULT_VHOSTS = config("RABBITMQ_DEFAULT_VHOSTS", default="/").split(",")
-RABBITMQ_USERNAME = config("RABBITMQ_USERNAME")
-RABBITMQ_PASSWORD = config("RABBITMQ_PASSWORD")
-
-# Logging to Loki
-LOKI_USER = config("LOKI_USER")
-LOKI_PASSWORD = config("LOKI_PASSWORD")
-LOKI_HOST = config("LOKI_HOST")
-SERVICE_NAME = config("SERVICE_NAME")
-
-# Timezone used in this app
-appTimezoneStr = config("TIMEZONE")
-appTimezone = pytz.timezone(appTimezoneStr)
-
-# S3 object
-S3_ENDPOINT = config("S3_ENDPOINT")
-S3_KEY = config("S3_KEY")
-S3_SECRET = config("S3_SECRET")
-s3 = boto3.resource(
-    "s3",
-    endpoint_url=S3_ENDPOINT,
-    aws_access_key_id=S3_KEY,
-    aws_secret_access_key=S3_SECRET,
-)
+
+# Settings are read from the environment the first time they are accessed as
+# attributes of this module, e.g. `config.S3_BUCKET_NAME`, so importing it is
+# cheap and a missing variable only fails the code path that needs it.
+# Clients built from these settings live in app.utilities.services.
+
+
+def _setting(*args, **kwargs):
+    return lambda: config(*args, **kwargs)
+
+
+def _timezone():
+    import pytz
+
+    return pytz.timezone(config("TIMEZONE"))
+
+
+_SETTINGS = {
+    "PAUSE": _setting("PAUSE", cast=bool, default=False),
+    # S3 bucket name
+    "S3_BUCKET_NAME": _setting("S3_BUCKET_NAME"),
+    # Polling interval (in seconds) for checking the S3 bucket for new files, pinging uptime monitor, etc.
+    "POLLING_INTERVAL": _setting("POLLING_INTERVAL", cast=int),
+    # Uptime monitor address
+    "UPTIME_MONITOR": _setting("UPTIME_MONITOR"),
+    # Number of files waiting between two stages of the pipeline, e.g. downloaded
+    # files waiting to be published, which also bounds the local disk used
+    "PIPELINE_QUEUE_SIZE": _setting("PIPELINE_QUEUE_SIZE", cast=int, default=1),
+    # Seconds a file found not ready to enqueue is not looked up in the db again,
+    # doubled each time it is still not ready up to the max, 0 disables the cache
+    "NOT_READY_CACHE_TTL": _setting("NOT_READY_CACHE_TTL", cast=int, default=30),
+    "NOT_READY_CACHE_MAX_TTL": _setting(
+        "NOT_READY_CACHE_MAX_TTL", cast=int, default=300
+    ),
+    # Database connection
+    "DATABASE_CONNECTION_STRING": _setting("DATABASE_CONNECTION_STRING"),
+    # Connection pool, the pool size plus the overflow also caps concurrent db tasks
+    "DATABASE_POOL_SIZE": _setting("DATABASE_POOL_SIZE", cast=int, default=5),
+    "DATABASE_MAX_OVERFLOW": _setting("DATABASE_MAX_OVERFLOW", cast=int, default=5),
+    "DATABASE_POOL_TIMEOUT": _setting("DATABASE_POOL_TIMEOUT", cast=int, default=30),
+    "DATABASE_POOL_RECYCLE": _setting(
+        "DATABASE_POOL_RECYCLE", cast=int, default=1800
+    ),
+    # RabbitMQ connection
+    "RABBITMQ_HOST": _setting("RABBITMQ_HOST"),
+    "RABBITMQ_DEFAULT_VHOSTS": lambda: config(
+        "RABBITMQ_DEFAULT_VHOSTS", default="/"
+    ).split(","),
+    "RABBITMQ_USERNAME": _setting("RABBITMQ_USERNAME"),
+    "RABBITMQ_PASSWORD": _setting("RABBITMQ_PASSWORD"),
+    # RabbitMQ Management API, request timeout and how long responses are reused (in seconds)
+    "RABBITMQ_MANAGEMENT_TIMEOUT": _setting(
+        "RABBITMQ_MANAGEMENT_TIMEOUT", cast=float, default=10
+    ),
+    "RABBITMQ_MANAGEMENT_CACHE_TTL": _setting(
+        "RABBITMQ_MANAGEMENT_CACHE_TTL", cast=float, default=2
+    ),
+    # Draining queues, prefetched and batch acknowledged messages and the
+    # seconds to wait for a message before the queue is considered empty
+    "RABBITMQ_DRAIN_PREFETCH": _setting(
+        "RABBITMQ_DRAIN_PREFETCH", cast=int, default=1000
+    ),
+    "RABBITMQ_DRAIN_ACK_BATCH": _setting(
+        "RABBITMQ_DRAIN_ACK_BATCH", cast=int, default=500
+    ),
+    "RABBITMQ_DRAIN_INACTIVITY_TIMEOUT": _setting(
+        "RABBITMQ_DRAIN_INACTIVITY_TIMEOUT", cast=float, default=30
+    ),
+    # Queue topology, selected per job by its row count
+    # Jobs at or above these row counts get a lazy classic queue or a quorum queue
+    "QUEUE_LAZY_ROW_THRESHOLD": _setting(
+        "QUEUE_LAZY_ROW_THRESHOLD", cast=int, default=100000
+    ),
+    "QUEUE_QUORUM_ROW_THRESHOLD": _setting(
+        "QUEUE_QUORUM_ROW_THRESHOLD", cast=int, default=1000000
+    ),
+    # Cap the queue length at the job's row count, the broker rejects the rows
+    # published to a full queue and they are reported as failed. This turns on
+    # publisher confirms, which makes publishing slower
+    "QUEUE_CAP_LENGTH_TO_ROW_COUNT": _setting(
+        "QUEUE_CAP_LENGTH_TO_ROW_COUNT", cast=bool, default=False
+    ),
+    # Jobs at or above this row count are split across QUEUE_SHARD_COUNT queues,
+    # by row `range` or email `hash`, 0 disables sharding
+    "QUEUE_SHARD_ROW_THRESHOLD": _setting(
+        "QUEUE_SHARD_ROW_THRESHOLD", cast=int, default=0
+    ),
+    "QUEUE_SHARD_COUNT": _setting("QUEUE_SHARD_COUNT", cast=int, default=4),
+    "QUEUE_SHARD_STRATEGY": _setting("QUEUE_SHARD_STRATEGY", default="range"),
+    # Deletion of batch_validation_* queues whose job is finished or errored, or
+    # that are empty and idle for QUEUE_REAPER_IDLE_SECONDS, every
+    # QUEUE_REAPER_INTERVAL seconds, a dry run only logs what would be deleted
+    "QUEUE_REAPER_ENABLED": _setting("QUEUE_REAPER_ENABLED", cast=bool, default=False),
+    "QUEUE_REAPER_DRY_RUN": _setting("QUEUE_REAPER_DRY_RUN", cast=bool, default=True),
+    "QUEUE_REAPER_INTERVAL": _setting("QUEUE_REAPER_INTERVAL", cast=int, default=600),
+    "QUEUE_REAPER_IDLE_SECONDS": _setting(
+        "QUEUE_REAPER_IDLE_SECONDS", cast=int, default=86400
+    ),
+    # Comma separated job statuses after which a job's queues are no longer needed,
+    # statuses starting with `error` always count
+    "QUEUE_REAPER_FINISHED_STATUSES": _setting(
+        "QUEUE_REAPER_FINISHED_STATUSES", default="completed"
+    ),
+    # Syntax check of the emails of a file before publishing, rejected rows are
+    # written to PREVALIDATION_SIDECAR_DIR instead of the queue, and uploaded to
+    # the bucket under PREVALIDATION_SIDECAR_PREFIX once the file is queued
+    "PREVALIDATE_EMAILS": _setting("PREVALIDATE_EMAILS", cast=bool, default=False),
+    "PREVALIDATION_SIDECAR_DIR": _setting(
+        "PREVALIDATION_SIDECAR_DIR", default="tmp/prevalidation"
+    ),
+    "PREVALIDATION_SIDECAR_PREFIX": _setting(
+        "PREVALIDATION_SIDECAR_PREFIX", default="validation/queued/"
+    ),
+    # Per file resource accounting, tracking Python allocations slows processing down
+    "TRACK_ALLOCATIONS": _setting("TRACK_ALLOCATIONS", cast=bool, default=False),
+    # Profiling of the single job whose file name is PROFILE_JOB, either with
+    # cProfile (`cprofile`) or by sampling stacks every PROFILE_SAMPLE_INTERVAL
+    # seconds (`sample`), profiles are written to PROFILE_DIR
+    "PROFILE_JOB": _setting("PROFILE_JOB", default=""),
+    "PROFILE_MODE": _setting("PROFILE_MODE", default="cprofile"),
+    "PROFILE_SAMPLE_INTERVAL": _setting(
+        "PROFILE_SAMPLE_INTERVAL", cast=float, default=0.005
+    ),
+    "PROFILE_DIR": _setting("PROFILE_DIR", default="tmp/profiles"),
+    # Logging to Loki
+    "LOKI_USER": _setting("LOKI_USER"),
+    "LOKI_PASSWORD": _setting("LOKI_PASSWORD"),
+    "LOKI_HOST": _setting("LOKI_HOST"),
+    "SERVICE_NAME": _setting("SERVICE_NAME"),
+    # Timezone used in this app
+    "appTimezoneStr": _setting("TIMEZONE"),
+    "appTimezone": _timezone,
+    # S3 connection
+    "S3_ENDPOINT": _setting("S3_ENDPOINT"),
+    "S3_KEY": _setting("S3_KEY"),
+    "S3_SECRET": _setting("S3_SECRET"),
+    # Files from this many bytes are downloaded as concurrent byte ranges
+    "S3_DOWNLOAD_THRESHOLD": _setting(
+        "S3_DOWNLOAD_THRESHOLD", cast=int, default=64 * 1024 * 1024
+    ),
+    "S3_DOWNLOAD_PART_SIZE": _setting(
+        "S3_DOWNLOAD_PART_SIZE", cast=int, default=16 * 1024 * 1024
+    ),
+    "S3_DOWNLOAD_CONCURRENCY": _setting("S3_DOWNLOAD_CONCURRENCY", cast=int, default=8),
+}
+
+_values = {}
+
+
+def __getattr__(name):
+    if name not in _SETTINGS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    if name not in _values:
+        _values[name] = _SETTINGS[name]()
+    return _values[name]
+
+
+def __dir__():
+    return sorted([*globals(), *_SETTINGS])
@@ -8,9 +8,18 @@ import io
 import os
 from datetime import datetime
 
-from app.utilities.rabbitmq import QueueAgent
 from app.utilities.logging import logger
 from app.utilities.database import get_job_uid_from_db
+from app.utilities.queue_topology import (
+    assign_shards,
+    build_queue_arguments,
+    get_shard_count,
+    get_shard_queue_name,
+)
+from app.utilities.services import get_queue_agent
+from app.utilities.profiling import ResourceAccountant, profile_job
+from app.utilities.prevalidation import prevalidate_emails, write_prevalidation_sidecar
+from app import config
 
 
 class FileEnqueuer:
@@ -18,21 +27,41 @@ class FileEnqueuer:
     Processor that reads CSV files and publishes rows to RabbitMQ
     """
 
-    def __init__(self):
+    def __init__(self, queue_agent=None):
         self.queue_prefix = "batch_validation"
-        self.queue_agent = QueueAgent()
+        # Share one RabbitMQ connection across files unless an agent is given
+        self.queue_agent = queue_agent or get_queue_agent()
 
-    def process_csv_file(self, filepath):
+    def process_csv_file(self, filepath, accountant=None):
         """
         Process CSV file and publish rows to dedicated queue
 
+        The resources used by each stage are accounted, and the file is profiled
+        if it is the job selected by PROFILE_JOB.
+
         Args:
             filepath: Path to CSV file
+            accountant: Optional ResourceAccountant of the file, to account
+                these stages next to the ones of the caller, who then finishes it
 
         Returns:
             Dict with processing results and statistics
         """
         filename = os.path.basename(filepath)
+        owns_accountant = accountant is None
+        if owns_accountant:
+            accountant = ResourceAccountant(filename)
+
+        with profile_job(filename):
+            result = self._process_csv_file(filepath, accountant)
+
+        result["stage_timings"] = accountant.stage_timings()
+        if owns_accountant:
+            result["resources"] = accountant.finish()
+        return result
+
+    def _process_csv_file(self, filepath, accountant):
+        filename = os.path.basename(filepath)
 
         if not self.queue_agent:
             logger.error("Queue agent is not initialized.")
@@ -51,12 +80,14 @@ class FileEnqueuer:
         try:
             # Read and validate CSV file
             logger.debug(f"Reading CSV file: {filepath}")
-            with open(filepath, "r", encoding="utf-8") as file:
-                csv_content = file.read()
+            with accountant.stage("read"):
+                with open(filepath, "r", encoding="utf-8") as file:
+                    csv_content = file.read()
 
             # Parse CSV to validate and count rows
-            csv_reader = csv.DictReader(io.StringIO(csv_content))
-            rows = list(csv_reader)
+            with accountant.stage("parse"):
+                csv_reader = csv.DictReader(io.StringIO(csv_content))
+                rows = list(csv_reader)
 
             if not rows:
                 logger.warning(f"No data rows found in {filename}")
@@ -68,39 +99,103 @@ class FileEnqueuer:
                     "message": "No data rows found",
                 }
 
-            # Declare durable queue for this file
-            self.queue_agent.create_queue(
-                queue_name,
-                arguments={
-                    "jobuid": get_job_uid_from_db(f"validation/in-progress/{filename}")
-                },
+            # Number the rows as they are in the file, the numbers of the rows
+            # rejected by the pre-validation are left out of the queue
+            numbered_rows = list(enumerate(rows, 1))
+            rows_short_circuited = 0
+            sidecar_path = None
+
+            if config.PREVALIDATE_EMAILS:
+                with accountant.stage("prevalidate"):
+                    reasons = prevalidate_emails([row["Email"] for row in rows])
+                    rejected_rows = [
+                        (row_num, row, reason)
+                        for (row_num, row), reason in zip(numbered_rows, reasons)
+                        if reason
+                    ]
+                    if rejected_rows:
+                        numbered_rows = [
+                            numbered_row
+                            for numbered_row, reason in zip(numbered_rows, reasons)
+                            if not reason
+                        ]
+                        sidecar_path = write_prevalidation_sidecar(
+                            filename, list(rows[0].keys()), rejected_rows
+                        )
+                rows_short_circuited = len(rejected_rows)
+                logger.info(
+                    f"Pre-validation rejected {rows_short_circuited}/{len(rows)} rows of {filename}"
+                    + (f", written to {sidecar_path}." if sidecar_path else ".")
+                )
+
+            # Split large files across several queues, all carrying the same jobuid
+            shard_count = get_shard_count(len(numbered_rows))
+            row_shards = assign_shards(
+                [row["Email"] for _, row in numbered_rows], shard_count
             )
+            shard_row_counts = [0] * shard_count
+            for shard_index in row_shards:
+                shard_row_counts[shard_index] += 1
+            shard_queue_names = [
+                get_shard_queue_name(queue_name, shard_index, shard_count)
+                for shard_index in range(shard_count)
+            ]
+
+            # Declare durable queue for each shard of this file, sized for its row count
+            shard_topologies = []
+            with accountant.stage("declare"):
+                jobuid = get_job_uid_from_db(f"validation/in-progress/{filename}")
+                for shard_index, shard_queue_name in enumerate(shard_queue_names):
+                    queue_arguments = build_queue_arguments(
+                        jobuid,
+                        shard_row_counts[shard_index],
+                        shard_index=shard_index,
+                        shard_count=shard_count,
+                        job_row_count=len(numbered_rows),
+                    )
+                    if not self.queue_agent.create_queue(
+                        shard_queue_name, arguments=queue_arguments
+                    ):
+                        raise Exception(f"Could not declare queue '{shard_queue_name}'.")
+                    shard_topologies.append(queue_arguments["topology"])
+                    logger.info(
+                        f"Selected '{queue_arguments['topology']}' topology for {shard_queue_name} ({shard_row_counts[shard_index]} rows)."
+                    )
 
             # Publish each row as individual message
             published_count = 0
+            failed_count = 0
             start_time = time.time()
 
-            for row_num, row in enumerate(rows, 1):
-                message = {
-                    "messageId": f"{filename}_row_{row_num}_{int(time.time() * 1000)}",
-                    "filename": filename,
-                    "filepath": filepath,
-                    "rowNumber": row_num,
-                    "totalRows": len(rows),
-                    "queueName": queue_name,
-                    "processedAt": datetime.utcnow().isoformat(),
-                    "email": row["Email"],
-                }
+            with accountant.stage("publish"):
+                for (row_num, row), shard_index in zip(numbered_rows, row_shards):
+                    shard_queue_name = shard_queue_names[shard_index]
+                    message = {
+                        "messageId": f"{filename}_row_{row_num}_{int(time.time() * 1000)}",
+                        "filename": filename,
+                        "filepath": filepath,
+                        "rowNumber": row_num,
+                        "totalRows": len(rows),
+                        "publishedRows": len(numbered_rows),
+                        "queueName": shard_queue_name,
+                        "jobQueueName": queue_name,
+                        "shardIndex": shard_index,
+                        "shardCount": shard_count,
+                        "processedAt": datetime.utcnow().isoformat(),
+                        "email": row["Email"],
+                    }
 
-                # Publish with persistence
-                self.queue_agent.publish_message(queue_name, message)
-                published_count += 1
+                    # Publish with persistence, rows rejected by the broker are counted apart
+                    if not self.queue_agent.publish_message(shard_queue_name, message):
+                        failed_count += 1
+                        continue
+                    published_count += 1
 
-                # Log progress periodically for large files
-                if published_count % 1000 == 0:
-                    logger.debug(
-                        f"Published {published_count}/{len(rows)} rows from {filename}"
-                    )
+                    # Log progress periodically for large files
+                    if published_count % 1000 == 0:
+                        logger.debug(
+                            f"Published {published_count}/{len(numbered_rows)} rows from {filename}"
+                        )
 
             processing_time = time.time() - start_time
 
@@ -108,16 +203,28 @@ class FileEnqueuer:
                 "filename": filename,
                 "filepath": filepath,
                 "queue_name": queue_name,
+                "queue_names": shard_queue_names,
+                "shard_count": shard_count,
+                # Shards can differ in size, so each has its own topology
+                "queue_topologies": shard_topologies,
                 "total_rows": len(rows),
                 "rows_published": published_count,
+                "rows_failed": failed_count,
+                "rows_short_circuited": rows_short_circuited,
+                "prevalidation_sidecar": sidecar_path,
                 "columns": list(rows[0].keys()) if rows else [],
                 "processing_time_seconds": round(processing_time, 2),
                 "processed_at": datetime.utcnow().isoformat(),
                 "status": "success",
             }
 
+            if failed_count:
+                logger.error(
+                    f"Failed to publish {failed_count}/{len(numbered_rows)} rows of the file {filename}."
+                )
+
             logger.info(
-                f"Successfully queued the rows of the file {filename}: {published_count} rows -> {queue_name}"
+                f"Successfully queued the rows of the file {filename}: {published_count} rows -> {', '.join(shard_queue_names)}"
             )
             return result
 
@@ -1,27 +1,166 @@
 import asyncio
+import functools
 import os
 
-from app.utilities.s3 import list_files, download_file, move_file
-from app.utilities.database import file_has_a_job_in_db, get_job_status, set_job_status
+from app.utilities.s3 import list_files, download_file, move_file, upload_file
+from app.utilities.database import get_job_status_async, set_job_status_async
 from app.utilities.logging import logger
+from app.utilities.profiling import ResourceAccountant, format_resource_usage
+from app.utilities.not_ready_cache import NotReadyCache
+from app.utilities.queue_topology import validate_shard_strategy
 from app.file_enqueuer import FileEnqueuer
-from app.config import (
-    PAUSE,
-    POLLING_INTERVAL,
-)
+from app.pipeline import PipelineStage, run_pipeline, format_pipeline_stats
+from app import config
+
+
+# The work on each file is split into stages connected by bounded queues, see
+# run_pipeline(), so e.g. the next file is looked up and downloaded while the
+# rows of the current one are published. Each stage receives and returns the
+# dict of the file, or returns None to skip the file.
+
+
+async def _look_up_job(item, not_ready_cache):
+    # Skip file without a db lookup if it was recently found not ready
+    if not_ready_cache.is_not_ready(item):
+        return None
+
+    status = await get_job_status_async(item["Key"])
+
+    # Skip file if we don't find a matching db record
+    if status is None:
+        logger.debug(f'{item["Key"]} does not have a db record, skipping it.')
+        not_ready_cache.mark_not_ready(item)
+        return None
+
+    # Skip file if db says the file is not file_accepted
+    if status != "file_accepted":
+        logger.debug(
+            f'{item["Key"]} has a db record but it is not file_accepted, skipping it.'
+        )
+        not_ready_cache.mark_not_ready(item)
+        return None
+
+    not_ready_cache.forget(item["Key"])
+
+    local_file_name = os.path.basename(item["Key"])
+    return {
+        "key": item["Key"],
+        "local_file_path": os.path.abspath(os.path.join("tmp/", local_file_name)),
+        "accountant": ResourceAccountant(local_file_name),
+    }
+
+
+async def _download(job):
+    # Download the file locally
+    with job["accountant"].stage("download"):
+        download = await asyncio.to_thread(
+            download_file, job["key"], job["local_file_path"]
+        )
+
+    # Skip file if the download failed, it stays in in-progress to be retried
+    if download is None:
+        return None
+
+    mib = 1024 * 1024
+    logger.debug(
+        f"Downloaded {job['key']} to {job['local_file_path']}: "
+        f"{download['bytes'] / mib:.1f}MiB in {download['parts']} parts, "
+        f"{download['seconds']:.2f}s, {download['bytes_per_second'] / mib:.1f}MiB/s"
+    )
+    return job
+
+
+async def _publish(job):
+    # Enqueue the file rows
+    processor = FileEnqueuer()
+    result = await asyncio.to_thread(
+        processor.process_csv_file,
+        job["local_file_path"],
+        accountant=job["accountant"],
+    )
+
+    # Skip file if its rows could not be published, it stays in in-progress to
+    # be retried. Files without data rows are finalized, a retry cannot change them
+    if result["status"] == "error":
+        logger.error(
+            f"Failed to process {result['filename']}: {result.get('error', 'Unknown error')}"
+        )
+        return None
+
+    job["prevalidation_sidecar"] = result.get("prevalidation_sidecar")
+    return job
+
+
+async def _finalize(job):
+    with job["accountant"].stage("finalize"):
+        # Update its status in db
+        await set_job_status_async(job["key"], "file_queued")
+
+        # Deliver the rows rejected by the pre-validation next to the queued file,
+        # the local sidecar is kept if that fails so the rows are not lost
+        local_paths = [job["local_file_path"]]
+        sidecar_path = job.get("prevalidation_sidecar")
+        if sidecar_path:
+            sidecar_key = config.PREVALIDATION_SIDECAR_PREFIX + os.path.basename(
+                sidecar_path
+            )
+            if await asyncio.to_thread(upload_file, sidecar_path, sidecar_key):
+                logger.info(f"Uploaded pre-validation sidecar to {sidecar_key}")
+                local_paths.append(sidecar_path)
+            else:
+                logger.error(f"Kept pre-validation sidecar at {sidecar_path}")
+
+        # Delete file from local
+        for local_path in local_paths:
+            try:
+                os.remove(local_path)
+            except Exception as e:
+                logger.error(f"Error deleting local file {local_path}: {e}")
+
+        # Move the remote file from in-progress to queued
+        await asyncio.to_thread(
+            move_file,
+            job["key"],
+            job["key"].replace("validation/in-progress/", "validation/queued/"),
+        )
+
+    # Log
+    logger.debug(f'Enqueued file: {job["key"]}')
+    logger.info(f"Resources used: {format_resource_usage(job['accountant'].finish())}")
+    return job
+
+
+def _drop(item):
+    # Stop accounting a file dropped after its lookup, which also stops the
+    # allocation tracing its accountant may have started
+    if "accountant" in item:
+        item["accountant"].finish()
+
+    # The file is downloaded again when it is retried
+    if os.path.exists(item.get("local_file_path") or ""):
+        os.remove(item["local_file_path"])
 
 
 async def enqueue_new_files():
+    # Stop here on a misconfiguration that would fail every large file
+    try:
+        validate_shard_strategy()
+    except ValueError as e:
+        logger.error(f"File to validation queue publisher cannot start: {e}")
+        raise
+
+    not_ready_cache = NotReadyCache()
+
     while True:
         # Pause if env variable is set to pause
-        if PAUSE:
+        if config.PAUSE:
             logger.info(
                 "File to validation queue publisher is paused, change the environment variable `PAUSE` to resume it."
             )
-            await asyncio.sleep(POLLING_INTERVAL)
+            await asyncio.sleep(config.POLLING_INTERVAL)
             continue
 
-        all_files = list_files(prefix="validation/in-progress/")
+        all_files = await asyncio.to_thread(list_files, prefix="validation/in-progress/")
         new_files = []
 
         # Pick the new files from
@@ -31,68 +170,39 @@ async def enqueue_new_files():
                 continue
             new_files.append(item)
 
+        # Forget the files that were moved or deleted meanwhile
+        not_ready_cache.retain(item["Key"] for item in new_files)
+
         if len(new_files) == 0:
             logger.debug(
-                f"No files were found. Sleeping for {POLLING_INTERVAL} seconds."
+                f"No files were found. Sleeping for {config.POLLING_INTERVAL} seconds."
             )
-            await asyncio.sleep(POLLING_INTERVAL)
+            await asyncio.sleep(config.POLLING_INTERVAL)
             continue
 
         logger.debug(
             f"{len(new_files)} new files are found: {', '.join([item['Key'] for item in new_files])}"
         )
 
-        # Looping separately from the above to save db queries
-        # by only checking the db status of files that are not
-        # in the queue of this worker
-        for item in new_files:
-            # Skip file if we don't find a matching db record
-            if not file_has_a_job_in_db(item["Key"]):
-                logger.debug(f'{item["Key"]} does not have a db record, skipping it.')
-                continue
-
-            # Skip file if db says the file is not file_accepted
-            if get_job_status(item["Key"]) != "file_accepted":
-                logger.debug(
-                    f'{item["Key"]} has a db record but it is not file_accepted, skipping it.'
-                )
-                continue
-
-            # Otherwise, enqueue the file rows
-            # Create file processor
-            processor = FileEnqueuer()
-
-            # Download the file locally
-            local_file_name = os.path.basename(item["Key"])
-            local_file_path_relative = os.path.join("tmp/", local_file_name)
-            local_file_path = os.path.abspath(local_file_path_relative)
-            download_file(item["Key"], local_file_path)
-            logger.debug(f"Downloaded {item['Key']} to {local_file_path}")
-
-            # Process the file
-            result = processor.process_csv_file(local_file_path)
-
-            if result["status"] != "success":
-                logger.error(
-                    f"Failed to process {result['filename']}: {result.get('error', 'Unknown error')}"
-                )
-
-            # Update its status in db
-            set_job_status(item["Key"], "file_queued")
-
-            # Delete file from local
-            try:
-                os.remove(local_file_path)
-            except Exception as e:
-                logger.error(f"Error deleting local file {local_file_path}: {e}")
-
-            # Move the remote file from in-progress to queued
-            move_file(
-                item["Key"],
-                item["Key"].replace("validation/in-progress/", "validation/queued/"),
-            )
-
-            # Log
-            logger.debug(f'Enqueued file: {item["Key"]}')
+        stages = [
+            # Look up several files at once, the pool caps the concurrent queries
+            PipelineStage(
+                "lookup",
+                functools.partial(_look_up_job, not_ready_cache=not_ready_cache),
+                workers=config.DATABASE_POOL_SIZE,
+            ),
+            PipelineStage("download", _download),
+            PipelineStage("publish", _publish),
+            PipelineStage("finalize", _finalize),
+        ]
+        stats = await run_pipeline(
+            new_files, stages, queue_size=config.PIPELINE_QUEUE_SIZE, on_drop=_drop
+        )
+        if stats["publish"]["items"]:
+            logger.info(f"Pipeline stage utilization: {format_pipeline_stats(stats)}")
+        logger.debug(
+            f"{len(not_ready_cache)} files are cached as not ready, "
+            f"{not_ready_cache.hits} lookups skipped and {not_ready_cache.misses} made so far."
+        )
 
-        await asyncio.sleep(POLLING_INTERVAL)
+        await asyncio.sleep(config.POLLING_INTERVAL)
@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+from app.utilities.logging import logger
+
+# Tells the workers of a stage that no more items will come
+_DONE = object()
+
+
+class PipelineStage:
+    """
+    A stage of a pipeline, run by one or more workers.
+
+    The function of a stage is a coroutine function that receives an item and
+    returns the item for the next stage, or None to drop it. An item is also
+    dropped if the function raises. Blocking work should be sent to a thread
+    with asyncio.to_thread(), so the other stages keep running meanwhile.
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+    async def _run(self, inbox, outbox, next_workers, stats, on_drop):
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is _DONE:
+                    return
+
+                start_time = time.perf_counter()
+                try:
+                    result = await self.func(item)
+                except Exception as e:
+                    logger.error(f"Error in pipeline stage '{self.name}': {e}")
+                    result = None
+
+                if result is None and on_drop is not None:
+                    try:
+                        on_drop(item)
+                    except Exception as e:
+                        logger.error(
+                            f"Error cleaning up an item dropped by pipeline stage '{self.name}': {e}"
+                        )
+                # Time spent waiting on a full outbox is not counted as busy time
+                stats["busy_seconds"] += time.perf_counter() - start_time
+                stats["items"] += 1
+
+                if result is not None and outbox is not None:
+                    await outbox.put(result)
+
+        await asyncio.gather(*(worker() for _ in range(self.workers)))
+
+        if outbox is not None:
+            for _ in range(next_workers):
+                await outbox.put(_DONE)
+
+
+async def run_pipeline(items, stages, queue_size=1, on_drop=None):
+    """
+    Pass items through stages connected by bounded queues.
+
+    Each stage works on the next item as soon as it is done with the current
+    one, so e.g. the next file is downloaded while the current one is published.
+    A full queue holds back the stage before it, which bounds the number of
+    items in flight.
+
+    Args:
+        items: The items to pass to the first stage.
+        stages: List of PipelineStage, in order.
+        queue_size: Number of items waiting between two stages.
+        on_drop: Optional callable that receives each item a stage drops, as
+            the stage received it, to release what the item holds.
+
+    Returns:
+        Dict with the number of items, the busy time and the utilization of
+        each stage, by stage name. The stage with the highest utilization is
+        the bottleneck.
+    """
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+    stats = {stage.name: {"items": 0, "busy_seconds": 0.0} for stage in stages}
+    start_time = time.perf_counter()
+
+    async def feed():
+        for item in items:
+            await queues[0].put(item)
+        for _ in range(stages[0].workers):
+            await queues[0].put(_DONE)
+
+    await asyncio.gather(
+        feed(),
+        *(
+            stage._run(
+                queues[index],
+                queues[index + 1] if index + 1 < len(stages) else None,
+                stages[index + 1].workers if index + 1 < len(stages) else 0,
+                stats[stage.name],
+                on_drop,
+            )
+            for index, stage in enumerate(stages)
+        ),
+    )
+
+    wall_time = time.perf_counter() - start_time
+    for stage in stages:
+        capacity = wall_time * stage.workers
+        stats[stage.name]["utilization"] = (
+            stats[stage.name]["busy_seconds"] / capacity if capacity else 0.0
+        )
+    return stats
+
+
+def format_pipeline_stats(stats):
+    """
+    Format the stats returned by run_pipeline() as a single log line.
+    """
+    return ", ".join(
+        f"{name} {stage['utilization']:.0%} busy ({stage['items']} items, {stage['busy_seconds']:.2f}s)"
+        for name, stage in stats.items()
+    )
@@ -0,0 +1,160 @@
+import asyncio
+from collections import Counter
+from datetime import datetime, timezone
+
+from app.utilities.database import get_job_statuses_by_uid_async
+from app.utilities.logging import logger
+from app.utilities.services import get_reaper_queue_agent
+from app import config
+
+QUEUE_PREFIX = "batch_validation_"
+
+# Totals of all reaper runs since startup, by outcome and reason
+reaper_metrics = Counter()
+
+
+def _parse_idle_since(idle_since):
+    """
+    Parse the idle_since attribute of a queue, which is in UTC.
+
+    Older RabbitMQ versions report it as `2024-01-31 12:00:00`, newer ones
+    as `2024-01-31T12:00:00.000+00:00`.
+    """
+    try:
+        parsed = datetime.fromisoformat(idle_since)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def select_queues_to_reap(queues, job_statuses, now=None):
+    """
+    Pick the batch_validation_* queues that can be deleted.
+
+    A queue is reaped if its job is finished or errored, or if it is empty,
+    has no consumers and has been idle for QUEUE_REAPER_IDLE_SECONDS. The
+    latter also covers orphaned queues, whose job does not exist.
+
+    Args:
+        queues: Queue dicts from the Management API.
+        job_statuses: Dict of job statuses by job uid.
+        now: The current time, now if not set.
+
+    Returns:
+        A list of (queue name, reason) tuples.
+    """
+    now = now or datetime.now(timezone.utc)
+    finished_statuses = [
+        status.strip()
+        for status in config.QUEUE_REAPER_FINISHED_STATUSES.split(",")
+        if status.strip()
+    ]
+
+    selected = []
+    for queue in queues:
+        name = queue.get("name", "")
+        if not name.startswith(QUEUE_PREFIX):
+            continue
+
+        status = job_statuses.get((queue.get("arguments") or {}).get("jobuid"))
+
+        if status in finished_statuses:
+            selected.append((name, "job_finished"))
+            continue
+        if status and status.startswith("error"):
+            selected.append((name, "job_errored"))
+            continue
+
+        idle_since = _parse_idle_since(queue.get("idle_since"))
+        if (
+            queue.get("messages", 0) == 0
+            and queue.get("consumers", 0) == 0
+            and idle_since
+            and (now - idle_since).total_seconds() >= config.QUEUE_REAPER_IDLE_SECONDS
+        ):
+            selected.append((name, "orphaned" if status is None else "empty_idle"))
+
+    return selected
+
+
+async def reap_queues_once(dry_run=None):
+    """
+    Delete the batch_validation_* queues picked by select_queues_to_reap().
+
+    Args:
+        dry_run: Only log the queues that would be deleted,
+            QUEUE_REAPER_DRY_RUN if not set.
+
+    Returns:
+        A Counter of the queues scanned, reaped (or that would be reaped in a
+        dry run, both also by reason), kept because they got work since they
+        were listed, already gone, and failed to delete.
+    """
+    if dry_run is None:
+        dry_run = config.QUEUE_REAPER_DRY_RUN
+
+    queue_agent = await asyncio.to_thread(get_reaper_queue_agent)
+    queues = await asyncio.to_thread(
+        queue_agent.list_all_queues_details,
+        columns=["name", "messages", "consumers", "idle_since", "arguments"],
+        name_regex=f"^{QUEUE_PREFIX}",
+        use_cache=False,
+    )
+    if queues is None:
+        return Counter({"errors": 1})
+
+    uids = {
+        (queue.get("arguments") or {}).get("jobuid")
+        for queue in queues
+        if (queue.get("arguments") or {}).get("jobuid")
+    }
+    job_statuses = await get_job_statuses_by_uid_async(uids)
+
+    metrics = Counter({"scanned": len(queues)})
+    for queue_name, reason in select_queues_to_reap(queues, job_statuses):
+        if dry_run:
+            logger.info(f"Queue reaper dry run, would delete '{queue_name}' ({reason}).")
+            metrics["would_reap"] += 1
+            metrics[f"would_reap_{reason}"] += 1
+            continue
+
+        # Queues reaped for being empty and idle are only deleted if they still are
+        empty_only = reason in ("orphaned", "empty_idle")
+        outcome = await asyncio.to_thread(
+            queue_agent.delete_queue_outcome,
+            queue_name,
+            if_empty=empty_only,
+            if_unused=empty_only,
+        )
+        match outcome:
+            case "deleted":
+                logger.info(f"Queue reaper deleted '{queue_name}' ({reason}).")
+                metrics["reaped"] += 1
+                metrics[f"reaped_{reason}"] += 1
+            case "kept":
+                # The queue got messages or a consumer since it was listed
+                metrics["kept"] += 1
+            case "not_found":
+                # Someone else deleted the queue since it was listed
+                metrics["gone"] += 1
+            case _:
+                metrics["errors"] += 1
+
+    return metrics
+
+
+async def reap_queues():
+    """
+    Reap finished and orphaned batch_validation_* queues every QUEUE_REAPER_INTERVAL seconds.
+    """
+    while True:
+        try:
+            metrics = await reap_queues_once()
+            reaper_metrics.update(metrics)
+            logger.info(
+                f"Queue reaper run: {dict(metrics)}, totals since startup: {dict(reaper_metrics)}"
+            )
+        except Exception as e:
+            logger.error(f"Error while reaping queues: {e}")
+        finally:
+            await asyncio.sleep(config.QUEUE_REAPER_INTERVAL)
@@ -0,0 +1,152 @@
+# Offline replay of the publisher against local files and a file backed broker
+
+import os
+import time
+import uuid
+
+from app.file_enqueuer import FileEnqueuer
+from app.utilities.file_broker import FileBackedQueueAgent
+from app.utilities.database import Base, BatchJobs, session_scope, set_job_status
+from app.utilities.services import get_db_engine
+from app.utilities.profiling import ResourceAccountant, get_peak_rss_bytes
+
+
+def collect_csv_files(path):
+    """
+    Get the CSV files to replay from a file or a directory path.
+    """
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name)
+            for name in os.listdir(path)
+            if name.lower().endswith(".csv")
+        )
+    return [path]
+
+
+def seed_jobs(filepaths):
+    """
+    Create a file_accepted job record in the local database for each file,
+    the same way the upstream services leave them for this publisher.
+    """
+    Base.metadata.create_all(get_db_engine())
+
+    with session_scope() as session:
+        for filepath in filepaths:
+            filename = os.path.basename(filepath)
+            key = f"validation/in-progress/{filename}"
+
+            job = session.query(BatchJobs).filter_by(accepted_file=key).first()
+            if job:
+                job.status = "file_accepted"
+                continue
+
+            session.add(
+                BatchJobs(
+                    uid=str(uuid.uuid4()),
+                    original_file_name=filename,
+                    uploaded_file=filename,
+                    accepted_file=key,
+                    header_row=0,
+                    source="replay",
+                    status="file_accepted",
+                )
+            )
+
+
+def run_replay(path, output_dir):
+    """
+    Run the FileEnqueuer pipeline on local CSV files with a file backed broker.
+
+    Args:
+        path: A CSV file or a directory of CSV files.
+        output_dir: Directory the queue files are written to.
+
+    Returns:
+        Dict with the per file results and the totals of the replay.
+    """
+    filepaths = collect_csv_files(path)
+    queue_agent = FileBackedQueueAgent(output_dir)
+    processor = FileEnqueuer(queue_agent=queue_agent)
+
+    start_time = time.perf_counter()
+
+    seed_start = time.perf_counter()
+    seed_jobs(filepaths)
+    seed_time = time.perf_counter() - seed_start
+
+    results = []
+    for filepath in filepaths:
+        accountant = ResourceAccountant(os.path.basename(filepath))
+        result = processor.process_csv_file(filepath, accountant=accountant)
+
+        with accountant.stage("status_update"):
+            set_job_status(
+                f"validation/in-progress/{os.path.basename(filepath)}", "file_queued"
+            )
+
+        result["resources"] = accountant.finish()
+        result["stage_timings"] = accountant.stage_timings()
+        result["wall_time_seconds"] = result["resources"]["wall_time_seconds"]
+        results.append(result)
+
+    queue_agent.disconnect()
+    wall_time = time.perf_counter() - start_time
+
+    rows_published = sum(result.get("rows_published", 0) for result in results)
+    return {
+        "files": results,
+        "file_count": len(filepaths),
+        "rows_published": rows_published,
+        "seed_time_seconds": seed_time,
+        "wall_time_seconds": wall_time,
+        "rows_per_second": rows_published / wall_time if wall_time else 0.0,
+        "peak_rss_bytes": get_peak_rss_bytes(),
+        "output_dir": output_dir,
+    }
+
+
+def print_report(report):
+    """
+    Print the results of a replay in a human readable form.
+    """
+    for result in report["files"]:
+        print(f"{result['filename']}: {result['status']}")
+        if result["status"] != "success":
+            print(f"  {result.get('error', result.get('message', ''))}")
+            continue
+
+        wall_time = result["wall_time_seconds"]
+        print(
+            f"  {result['rows_published']} rows -> "
+            + ", ".join(
+                f"{queue_name} ({topology})"
+                for queue_name, topology in zip(
+                    result["queue_names"], result["queue_topologies"]
+                )
+            )
+            + ", "
+            f"{result['rows_published'] / wall_time if wall_time else 0:.0f} rows/s"
+        )
+        for stage, record in result["resources"]["stages"].items():
+            allocated = record["allocated_peak_bytes"]
+            print(
+                f"    {stage:<14}{record['seconds'] * 1000:>12.1f} ms"
+                + (
+                    f"{allocated / (1024 * 1024):>10.1f} MiB allocated"
+                    if allocated is not None
+                    else ""
+                )
+            )
+        print(
+            f"  peak RSS raised by "
+            f"{result['resources']['peak_rss_increase_bytes'] / (1024 * 1024):.1f} MiB"
+        )
+
+    print(f"Files:       {report['file_count']}")
+    print(f"Rows:        {report['rows_published']}")
+    print(f"DB seeding:  {report['seed_time_seconds'] * 1000:.1f} ms")
+    print(f"Wall time:   {report['wall_time_seconds']:.3f} s")
+    print(f"Throughput:  {report['rows_per_second']:.0f} rows/s")
+    print(f"Peak RSS:    {report['peak_rss_bytes'] / (1024 * 1024):.1f} MiB")
+    print(f"Queues in:   {report['output_dir']}")
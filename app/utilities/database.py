@@ -1,7 +1,8 @@
+import asyncio
+from contextlib import contextmanager
 from datetime import datetime, timezone
 
 from sqlalchemy import (
-    create_engine,
     Column,
     Integer,
     BigInteger,
@@ -9,12 +10,12 @@ from sqlalchemy import (
     DateTime,
     ForeignKey,
 )
-from sqlalchemy.orm import sessionmaker, declarative_base, relationship
+from sqlalchemy.orm import declarative_base, relationship
 
-from app.config import DATABASE_CONNECTION_STRING, appTimezone
+from app import config
+from app.utilities.services import get_db_sessionmaker
 
-# Create an engine
-engine = create_engine(DATABASE_CONNECTION_STRING, pool_pre_ping=True)
+# The engine and the session factory are built on first use, see app.utilities.services
 
 # Define a base class for declarative class definitions
 Base = declarative_base()
@@ -39,7 +40,7 @@ class BatchJobs(Base):
     uploaded = Column(
         DateTime(),
         nullable=False,
-        default=datetime.now(timezone.utc).astimezone(appTimezone),
+        default=lambda: datetime.now(timezone.utc).astimezone(config.appTimezone),
     )
     started = Column(
         DateTime(),
@@ -54,42 +55,115 @@ class Users(Base):
     credits = Column(BigInteger)
 
     def save(self):
-        # inject self into db session
-        session.add(self)
+        # inject self into a short lived session, commit and save the object
+        with session_scope() as session:
+            session.add(self)
 
-        # commit change and save the object
+        return self
+
+
+# Caps the db calls running at once to the connections the pool can hand out,
+# created on first use since the pool size is read from the environment
+_db_semaphore = None
+
+
+@contextmanager
+def session_scope():
+    """
+    Provide a short transaction around a series of operations.
+
+    The session is committed when the block exits, rolled back if it raises,
+    and always closed, so a failed query cannot poison later ones.
+    """
+    session = get_db_sessionmaker()()
+    try:
+        yield session
         session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
 
-        return self
 
+async def run_db(func, *args, **kwargs):
+    """
+    Run a blocking db function in a worker thread without blocking the event loop.
+    """
+    global _db_semaphore
+    if _db_semaphore is None:
+        _db_semaphore = asyncio.Semaphore(
+            config.DATABASE_POOL_SIZE + config.DATABASE_MAX_OVERFLOW
+        )
 
-# Create a session
-Session = sessionmaker(bind=engine)
-session = Session()
+    async with _db_semaphore:
+        return await asyncio.to_thread(func, *args, **kwargs)
 
 
 def update_job_status(file, **kwargs):
-    job = session.query(BatchJobs).filter_by(accepted_file=file).first()
-    for key, value in kwargs.items():
-        setattr(job, key, value)
-    session.commit()
+    with session_scope() as session:
+        job = session.query(BatchJobs).filter_by(accepted_file=file).first()
+        if not job:
+            return False
+        for key, value in kwargs.items():
+            setattr(job, key, value)
+    return True
 
 
 def file_has_a_job_in_db(file):
-    return session.query(BatchJobs).filter_by(accepted_file=file).first() is not None
+    with session_scope() as session:
+        return (
+            session.query(BatchJobs.id).filter_by(accepted_file=file).first()
+            is not None
+        )
 
 
 def get_job_status(file):
-    job = session.query(BatchJobs).filter_by(accepted_file=file).first()
-    return job.status
+    with session_scope() as session:
+        job = session.query(BatchJobs.status).filter_by(accepted_file=file).first()
+        return job.status if job else None
 
 
 def set_job_status(file, status):
-    job = session.query(BatchJobs).filter_by(accepted_file=file).first()
-    job.status = status
-    session.commit()
+    return update_job_status(file, status=status)
 
 
 def get_job_uid_from_db(file):
-    job = session.query(BatchJobs).filter_by(accepted_file=file).first()
-    return job.uid if job else None
+    with session_scope() as session:
+        job = session.query(BatchJobs.uid).filter_by(accepted_file=file).first()
+        return job.uid if job else None
+
+
+def get_job_statuses_by_uid(uids):
+    """
+    Look up the statuses of several jobs by their uids in one query.
+
+    Returns:
+        A dict of statuses by job uid, jobs that do not exist are left out.
+    """
+    if not uids:
+        return {}
+
+    with session_scope() as session:
+        jobs = (
+            session.query(BatchJobs.uid, BatchJobs.status)
+            .filter(BatchJobs.uid.in_(list(uids)))
+            .all()
+        )
+        return {job.uid: job.status for job in jobs}
+
+
+async def get_job_status_async(file):
+    return await run_db(get_job_status, file)
+
+
+async def set_job_status_async(file, status):
+    return await run_db(set_job_status, file, status)
+
+
+async def get_job_uid_from_db_async(file):
+    return await run_db(get_job_uid_from_db, file)
+
+
+async def get_job_statuses_by_uid_async(uids):
+    return await run_db(get_job_statuses_by_uid, uids)
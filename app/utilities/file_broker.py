@@ -0,0 +1,107 @@
+import json
+import os
+
+from app.utilities.logging import logger
+
+
+class FileBackedQueueAgent:
+    """
+    Local stand-in for QueueAgent that writes queues to disk instead of RabbitMQ.
+
+    Each queue is stored in the output directory as `<queue_name>.jsonl`, one
+    published message per line, with its declaration arguments next to it in
+    `<queue_name>.arguments.json`. Queue files are started fresh by each
+    instance. Used for offline replays and profiling.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.rabbitmq_vhost = "file"
+        self.queue_arguments = {}
+        self.message_counts = {}
+        self._files = {}
+
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def _queue_path(self, queue_name):
+        return os.path.join(self.output_dir, f"{queue_name}.jsonl")
+
+    def disconnect(self):
+        """Flush and close all open queue files"""
+        for file in self._files.values():
+            file.close()
+        self._files = {}
+
+    def create_queue(self, queue_name, arguments={}):
+        """
+        Create a queue file if it does not exist and record its arguments.
+        """
+        self.queue_arguments[queue_name] = dict(arguments)
+        self.message_counts.setdefault(queue_name, 0)
+
+        with open(
+            os.path.join(self.output_dir, f"{queue_name}.arguments.json"), "w"
+        ) as file:
+            json.dump(arguments, file, indent=2)
+
+        if queue_name not in self._files:
+            self._files[queue_name] = open(
+                self._queue_path(queue_name), "w", encoding="utf-8"
+            )
+
+        logger.debug(f"Created file backed queue: '{queue_name}'.")
+        return True
+
+    def delete_queue(self, queue_name):
+        """
+        Delete a queue file if it exists.
+        """
+        file = self._files.pop(queue_name, None)
+        if file:
+            file.close()
+
+        self.queue_arguments.pop(queue_name, None)
+        self.message_counts.pop(queue_name, None)
+
+        try:
+            os.remove(self._queue_path(queue_name))
+        except FileNotFoundError:
+            return False
+
+        logger.debug(f"Deleted file backed queue: '{queue_name}'.")
+        return True
+
+    def publish_message(self, queue_name, message_body):
+        """
+        Append a message to the file of the specified queue.
+
+        Returns:
+            True if the message was written, False if the queue was not created.
+        """
+        file = self._files.get(queue_name)
+        if not file:
+            logger.warning(f"Queue '{queue_name}' was not created before publishing.")
+            return False
+
+        file.write(json.dumps(message_body))
+        file.write("\n")
+        self.message_counts[queue_name] += 1
+        return True
+
+    def get_message_count(self, queue_name, message_type="ready"):
+        """
+        Get the number of messages written to a queue file.
+        """
+        return self.message_counts.get(queue_name)
+
+    def get_expected_message_count(self, queue_name):
+        """
+        Get the expected message count from the queue arguments.
+        """
+        return self.queue_arguments.get(queue_name, {}).get("row_count")
+
+    def get_job_uid(self, queue_name):
+        """
+        Get the value of the jobuid argument of a queue.
+        """
+        return self.queue_arguments.get(queue_name, {}).get("jobuid")
@@ -1,7 +1,38 @@
 import logging
-import logging_loki
 
-from app.config import LOKI_HOST, LOKI_PASSWORD, LOKI_USER, SERVICE_NAME
+from app import config
+
+
+class _LazyLokiHandler(logging.Handler):
+    """
+    Forwards records to Loki, connecting the Loki handler on the first record.
+
+    Records are dropped when no Loki host is set (e.g. offline replays).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._handler = None
+        self._disabled = False
+
+    def emit(self, record):
+        if self._disabled:
+            return
+
+        if self._handler is None:
+            from app.utilities.services import get_loki_handler
+
+            try:
+                if not config.LOKI_HOST:
+                    self._disabled = True
+                    return
+                self._handler = get_loki_handler()
+            except Exception:
+                self._disabled = True
+                self.handleError(record)
+                return
+
+        self._handler.handle(record)
 
 
 def _set_up_logger():
@@ -10,12 +41,7 @@ def _set_up_logger():
     """
 
     # Set up Loki handler
-    loki_handler = logging_loki.LokiHandler(
-        url=f"{LOKI_HOST}/loki/api/v1/push",
-        tags={"application": "maillistshield", "service": SERVICE_NAME},
-        auth=(LOKI_USER, LOKI_PASSWORD),
-        version="1",
-    )
+    loki_handler = _LazyLokiHandler()
 
     # Set up the console handler
     console_handler = logging.StreamHandler()
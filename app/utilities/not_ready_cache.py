@@ -0,0 +1,81 @@
+import time
+
+from app import config
+
+
+class NotReadyCache:
+    """
+    Remembers the files that were found not ready to enqueue, to skip their db
+    lookup on the next polls.
+
+    An entry is keyed by the S3 key and is only valid for the same version of
+    the object, identified by its ETag and LastModified, so a replaced file is
+    looked up again right away. Each consecutive "not ready" verdict doubles
+    the time the entry is valid for, from NOT_READY_CACHE_TTL up to
+    NOT_READY_CACHE_MAX_TTL, so files that stay stuck are looked up less often
+    while a file that becomes ready waits at most NOT_READY_CACHE_MAX_TTL.
+    """
+
+    def __init__(self, ttl=None, max_ttl=None):
+        self.ttl = config.NOT_READY_CACHE_TTL if ttl is None else ttl
+        self.max_ttl = config.NOT_READY_CACHE_MAX_TTL if max_ttl is None else max_ttl
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _version(item):
+        return (item.get("ETag"), item.get("LastModified"))
+
+    def is_not_ready(self, item):
+        """
+        Check if the file was found not ready and its entry is still valid.
+
+        Args:
+            item: The object dict from the S3 listing.
+        """
+        entry = self._entries.get(item["Key"])
+        if (
+            entry is not None
+            and entry["version"] == self._version(item)
+            and time.monotonic() < entry["expires_at"]
+        ):
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        return False
+
+    def mark_not_ready(self, item):
+        """
+        Remember that the file is not ready, backing off if it already was.
+        """
+        entry = self._entries.get(item["Key"])
+        version = self._version(item)
+        # The count of verdicts starts over when the object changes
+        strikes = entry["strikes"] + 1 if entry and entry["version"] == version else 1
+
+        ttl = min(self.ttl * 2 ** (strikes - 1), max(self.ttl, self.max_ttl))
+        self._entries[item["Key"]] = {
+            "version": version,
+            "strikes": strikes,
+            "expires_at": time.monotonic() + ttl,
+        }
+
+    def forget(self, key):
+        self._entries.pop(key, None)
+
+    def retain(self, keys):
+        """
+        Drop the entries of the files that are no longer listed.
+
+        Args:
+            keys: The keys of the files currently listed.
+        """
+        keys = set(keys)
+        for key in list(self._entries):
+            if key not in keys:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,106 @@
+import csv
+import os
+import re
+
+from app import config
+
+# Characters that are never valid in an address outside of quoted local parts,
+# which are too rare in mailing lists to be worth validating downstream
+_ILLEGAL_CHARACTERS = r"[\s()<>\[\]:;,\\\"]"
+
+# A top level domain of at least two letters, or an internationalized one
+_TLD = r"\.(?:[^\W\d_]{2,}|xn--[A-Za-z0-9-]+)$"
+
+# Matches only emails that pass every check below, so the reasons only need to
+# be worked out for the few emails it does not match
+_ATOM = r"[^\s()<>\[\]:;,\\\"@.]"
+_LABEL = rf"(?!-){_ATOM}+(?<!-)"
+_VALID_EMAIL = (
+    rf"(?=.{{1,254}}$)(?=[^@]{{1,64}}@)"
+    rf"{_ATOM}+(?:\.{_ATOM}+)*"
+    rf"@(?:{_LABEL}\.)+(?:[^\W\d_]{{2,}}|xn--[A-Za-z0-9-]*[A-Za-z0-9])"
+)
+
+_VALID_EMAIL_RE = re.compile(_VALID_EMAIL)
+_ILLEGAL_CHARACTERS_RE = re.compile(_ILLEGAL_CHARACTERS)
+_TLD_RE = re.compile(_TLD)
+_HYPHENATED_LABEL_RE = re.compile(r"(?:^|\.)-|-(?:\.|$)")
+
+
+def _find_reason(email):
+    if email == "":
+        return "empty"
+    if len(email) > 254:
+        return "too_long"
+    if "@" not in email:
+        return "missing_at"
+    if email.count("@") > 1:
+        return "multiple_at"
+    if _ILLEGAL_CHARACTERS_RE.search(email):
+        return "illegal_characters"
+
+    local_part, domain = email.split("@", 1)
+    if (
+        local_part == ""
+        or len(local_part) > 64
+        or local_part.startswith(".")
+        or local_part.endswith(".")
+        or ".." in local_part
+    ):
+        return "invalid_local_part"
+    if (
+        len(domain) > 253
+        or ".." in domain
+        or _HYPHENATED_LABEL_RE.search(domain)
+        or not _TLD_RE.search(domain)
+    ):
+        return "invalid_domain"
+    return ""
+
+
+def prevalidate_emails(emails):
+    """
+    Check the syntax of all emails of a file.
+
+    The checks only reject addresses that can never be delivered to. Most
+    emails are valid and pass with a single match of a compiled regex, the
+    reason is only worked out for the ones that do not.
+
+    Args:
+        emails: A list of email strings.
+
+    Returns:
+        A list with the reason each email is rejected for, one of `empty`,
+        `too_long`, `missing_at`, `multiple_at`, `illegal_characters`,
+        `invalid_local_part` or `invalid_domain`, or an empty string for
+        emails that pass.
+    """
+    reasons = []
+    for email in emails:
+        email = "" if email is None else str(email).strip()
+        reasons.append("" if _VALID_EMAIL_RE.fullmatch(email) else _find_reason(email))
+    return reasons
+
+
+def write_prevalidation_sidecar(filename, columns, rejected_rows):
+    """
+    Write the rows rejected by the pre-validation of a file next to its results.
+
+    Args:
+        filename: Name of the file the rows are from.
+        columns: The columns of the file.
+        rejected_rows: List of (row number, row dict, reason) tuples.
+
+    Returns:
+        The path of the sidecar file.
+    """
+    os.makedirs(config.PREVALIDATION_SIDECAR_DIR, exist_ok=True)
+    path = os.path.join(config.PREVALIDATION_SIDECAR_DIR, f"{filename}.rejected.csv")
+
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["rowNumber", *columns, "reason"])
+        for row_num, row, reason in rejected_rows:
+            writer.writerow([row_num, *(row.get(column) for column in columns), reason])
+
+    return path
@@ -0,0 +1,213 @@
+import cProfile
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+import psutil
+
+from app import config
+from app.utilities.logging import logger
+
+
+def get_peak_rss_bytes():
+    """
+    Get the peak resident set size of this process in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class ResourceAccountant:
+    """
+    Accounts the resources used while processing a single file.
+
+    Each stage records its wall time and the change of the resident set size.
+    With allocation tracking enabled, it also records the peak of the memory
+    allocated by Python during the stage. Since the peak RSS of a process
+    cannot be reset, the accountant reports how much the file raised it, which
+    tells which file made the process spike.
+    """
+
+    def __init__(self, name, track_allocations=None):
+        self.name = name
+        self.stages = {}
+
+        if track_allocations is None:
+            track_allocations = config.TRACK_ALLOCATIONS
+        # Only stop the tracing we started, someone else may be tracing too
+        self._started_tracing = track_allocations and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+
+        self._process = psutil.Process()
+        self._start_time = time.perf_counter()
+        self._start_peak_rss = get_peak_rss_bytes()
+
+    @contextmanager
+    def stage(self, stage_name):
+        """
+        Account the resources used by the block as the given stage.
+
+        Entering the same stage again adds to its totals.
+        """
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            allocated_before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        rss_before = self._process.memory_info().rss
+        start_time = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            record = self.stages.setdefault(
+                stage_name,
+                {"seconds": 0.0, "rss_delta_bytes": 0, "allocated_peak_bytes": None},
+            )
+            record["seconds"] += time.perf_counter() - start_time
+            record["rss_delta_bytes"] += self._process.memory_info().rss - rss_before
+            # Tracing may have been stopped meanwhile by the accountant that started it
+            if tracing and tracemalloc.is_tracing():
+                allocated_peak = tracemalloc.get_traced_memory()[1] - allocated_before
+                record["allocated_peak_bytes"] = max(
+                    record["allocated_peak_bytes"] or 0, allocated_peak
+                )
+
+    def stage_timings(self):
+        """
+        Get the wall time spent in each stage, in seconds.
+        """
+        return {name: record["seconds"] for name, record in self.stages.items()}
+
+    def finish(self):
+        """
+        Stop accounting and summarize the resources used by the file.
+
+        Returns:
+            Dict with the wall time, the resources used by each stage, and the
+            current and peak RSS of the process.
+        """
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+        peak_rss = get_peak_rss_bytes()
+        return {
+            "name": self.name,
+            "wall_time_seconds": time.perf_counter() - self._start_time,
+            "stages": self.stages,
+            "rss_bytes": self._process.memory_info().rss,
+            "peak_rss_bytes": peak_rss,
+            "peak_rss_increase_bytes": peak_rss - self._start_peak_rss,
+        }
+
+
+def format_resource_usage(usage):
+    """
+    Format a summary returned by ResourceAccountant.finish() as a single log line.
+    """
+    mib = 1024 * 1024
+    stages = ", ".join(
+        f"{name} {record['seconds']:.2f}s"
+        + (
+            f"/{record['allocated_peak_bytes'] / mib:.1f}MiB allocated"
+            if record["allocated_peak_bytes"] is not None
+            else ""
+        )
+        for name, record in usage["stages"].items()
+    )
+    return (
+        f"{usage['name']}: {usage['wall_time_seconds']:.2f}s ({stages}), "
+        f"RSS {usage['rss_bytes'] / mib:.1f}MiB, "
+        f"peak RSS {usage['peak_rss_bytes'] / mib:.1f}MiB "
+        f"(+{usage['peak_rss_increase_bytes'] / mib:.1f}MiB)"
+    )
+
+
+class _StackSampler:
+    """
+    Samples the stack of a thread at a fixed interval from a background thread.
+
+    The samples are written in the collapsed stack format, one stack per line
+    with its sample count, which flame graph tools read directly.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, path):
+        with open(path, "w") as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profile_job(name):
+    """
+    Profile the block if it processes the job selected by PROFILE_JOB.
+
+    PROFILE_MODE selects a deterministic profile (`cprofile`, written as a
+    pstats `.prof` file) or a sampling profile (`sample`, written as collapsed
+    stacks in a `.folded` file). Profiles are written to PROFILE_DIR.
+
+    Args:
+        name: Name of the job, the file name it is processed from.
+    """
+    if not config.PROFILE_JOB or config.PROFILE_JOB != name:
+        yield
+        return
+
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    path = os.path.join(
+        config.PROFILE_DIR, f"{name}-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    )
+
+    if config.PROFILE_MODE == "sample":
+        profiler = _StackSampler(threading.get_ident(), config.PROFILE_SAMPLE_INTERVAL)
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            profiler.dump(f"{path}.folded")
+            logger.info(f"Wrote sampling profile of {name} to {path}.folded")
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f"{path}.prof")
+            logger.info(f"Wrote profile of {name} to {path}.prof")
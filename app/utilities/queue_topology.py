@@ -0,0 +1,143 @@
+import zlib
+
+from app import config
+
+SHARD_STRATEGIES = ["range", "hash"]
+
+
+def select_queue_topology(row_count):
+    """
+    Pick the queue type for a job from the number of rows it will publish.
+
+    Small jobs stay in a classic queue kept in memory, large jobs go to a lazy
+    classic queue that pages messages to disk, and the largest jobs go to a
+    quorum queue so they are replicated and never held fully in broker RAM.
+
+    Args:
+        row_count: Number of messages the job will publish.
+
+    Returns:
+        One of "classic", "lazy" or "quorum".
+    """
+    if row_count >= config.QUEUE_QUORUM_ROW_THRESHOLD:
+        return "quorum"
+    if row_count >= config.QUEUE_LAZY_ROW_THRESHOLD:
+        return "lazy"
+    return "classic"
+
+
+def build_queue_arguments(
+    jobuid, row_count, shard_index=0, shard_count=1, job_row_count=None
+):
+    """
+    Build the arguments used to declare the queue of a job.
+
+    The selected topology and the row count are stored in the queue arguments,
+    so they can be read back from the management API later, e.g. by
+    QueueAgent.get_expected_message_count(). The shard metadata lets consumers
+    treat the queues of a sharded job as one job.
+
+    Args:
+        jobuid: The uid of the job the queue belongs to.
+        row_count: Number of messages the job will publish to this queue.
+        shard_index: Index of the shard this queue holds.
+        shard_count: Number of queues the job is sharded into.
+        job_row_count: Number of messages of the whole job, row_count if not set.
+
+    Returns:
+        A dict of queue arguments.
+    """
+    topology = select_queue_topology(row_count)
+
+    arguments = {
+        "jobuid": jobuid,
+        "row_count": row_count,
+        "topology": topology,
+        "shard_index": shard_index,
+        "shard_count": shard_count,
+        "job_row_count": row_count if job_row_count is None else job_row_count,
+    }
+
+    match topology:
+        case "quorum":
+            arguments["x-queue-type"] = "quorum"
+        case "lazy":
+            arguments["x-queue-mode"] = "lazy"
+
+    if config.QUEUE_CAP_LENGTH_TO_ROW_COUNT and row_count > 0:
+        arguments["x-max-length"] = row_count
+        arguments["x-overflow"] = "reject-publish"
+
+    return arguments
+
+
+def get_shard_count(row_count):
+    """
+    Get the number of queues a job is sharded into.
+
+    Jobs with at least QUEUE_SHARD_ROW_THRESHOLD rows are split across
+    QUEUE_SHARD_COUNT queues, so they can be consumed by more than one broker core.
+    """
+    if (
+        config.QUEUE_SHARD_ROW_THRESHOLD <= 0
+        or row_count < config.QUEUE_SHARD_ROW_THRESHOLD
+    ):
+        return 1
+    return max(1, min(config.QUEUE_SHARD_COUNT, row_count))
+
+
+def validate_shard_strategy(strategy=None):
+    """
+    Check that a shard strategy, QUEUE_SHARD_STRATEGY if not given, is known.
+
+    Raises:
+        ValueError if the strategy is unknown.
+    """
+    strategy = strategy or config.QUEUE_SHARD_STRATEGY
+    if strategy not in SHARD_STRATEGIES:
+        raise ValueError(
+            f"Unknown shard strategy '{strategy}', expected one of {', '.join(SHARD_STRATEGIES)}."
+        )
+
+
+def assign_shards(emails, shard_count, strategy=None):
+    """
+    Assign each row of a job to a shard.
+
+    Args:
+        emails: The email of each row, in row order.
+        shard_count: Number of shards.
+        strategy: `range` for contiguous, balanced row ranges, or `hash` to
+            spread rows by a stable hash of the email. QUEUE_SHARD_STRATEGY if not set.
+
+    Returns:
+        A list with the shard index of each row.
+
+    Raises:
+        ValueError if the strategy is unknown.
+    """
+    row_count = len(emails)
+    if shard_count == 1:
+        return [0] * row_count
+
+    strategy = strategy or config.QUEUE_SHARD_STRATEGY
+    validate_shard_strategy(strategy)
+
+    match strategy:
+        case "hash":
+            return [
+                zlib.crc32((email or "").strip().lower().encode("utf-8"))
+                % shard_count
+                for email in emails
+            ]
+        case "range":
+            return [index * shard_count // row_count for index in range(row_count)]
+
+
+def get_shard_queue_name(queue_name, shard_index, shard_count):
+    """
+    Get the name of the queue of a shard, unsharded jobs keep the queue name.
+    """
+    if shard_count == 1:
+        return queue_name
+    return f"{queue_name}_shard_{shard_index}"
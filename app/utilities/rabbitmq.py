@@ -1,10 +1,6 @@
-from app.config import (
-    RABBITMQ_HOST,
-    RABBITMQ_DEFAULT_VHOSTS,
-    RABBITMQ_USERNAME,
-    RABBITMQ_PASSWORD,
-)
+from app import config
 from app.utilities.logging import logger
+from app.utilities.rabbitmq_management import ManagementClient
 import requests
 import pika
 import time
@@ -20,19 +16,25 @@ class QueueAgent:
 
     def __init__(
         self,
-        rabbitmq_vhost=RABBITMQ_DEFAULT_VHOSTS[0],
-        rabbitmq_host=RABBITMQ_HOST,
+        rabbitmq_vhost=None,
+        rabbitmq_host=None,
         rabbitmq_port=5672,
-        rabbitmq_username=RABBITMQ_USERNAME,
-        rabbitmq_password=RABBITMQ_PASSWORD,
+        rabbitmq_username=None,
+        rabbitmq_password=None,
     ):
-        self.rabbitmq_vhost = rabbitmq_vhost
-        self.rabbitmq_host = rabbitmq_host
+        # Unset connection settings default to the environment
+        self.rabbitmq_vhost = rabbitmq_vhost or config.RABBITMQ_DEFAULT_VHOSTS[0]
+        self.rabbitmq_host = rabbitmq_host or config.RABBITMQ_HOST
         self.rabbitmq_port = rabbitmq_port
-        self.rabbitmq_username = rabbitmq_username
-        self.rabbitmq_password = rabbitmq_password
-
-        self.url = f"https://{self.rabbitmq_host}/api/queues/{self.rabbitmq_vhost.replace('/', '%2F')}"
+        self.rabbitmq_username = rabbitmq_username or config.RABBITMQ_USERNAME
+        self.rabbitmq_password = rabbitmq_password or config.RABBITMQ_PASSWORD
+
+        self.management = ManagementClient(
+            self.rabbitmq_host,
+            self.rabbitmq_vhost,
+            self.rabbitmq_username,
+            self.rabbitmq_password,
+        )
         self.connection = None
         self.channel = None
 
@@ -58,10 +60,7 @@ class QueueAgent:
                     blocked_connection_timeout=300,
                 )
                 self.connection = pika.BlockingConnection(parameters)
-                self.channel = self.connection.channel()
-
-                # Only allow one unacknowledged message at a time
-                self.channel.basic_qos(prefetch_count=1)
+                self._open_channel()
 
                 logger.debug(
                     f"Connected to RabbitMQ at {self.rabbitmq_host}:{self.rabbitmq_port}/{self.rabbitmq_vhost}"
@@ -76,8 +75,42 @@ class QueueAgent:
         logger.error("Failed to connect to RabbitMQ after multiple attempts.")
         return False
 
+    def _open_channel(self):
+        """Open a new channel on the current connection"""
+        self.channel = self.connection.channel()
+
+        # Only allow one unacknowledged message at a time
+        self.channel.basic_qos(prefetch_count=1)
+
+        # Publishes rejected by a queue capped at its row count are only
+        # reported to the publisher with confirms
+        if config.QUEUE_CAP_LENGTH_TO_ROW_COUNT:
+            self.channel.confirm_delivery()
+
+    def _reopen_channel(self):
+        """
+        Open a new channel after the broker closed the current one, reconnecting
+        if the connection is gone too.
+        """
+        try:
+            self._open_channel()
+            return True
+        except Exception as e:
+            logger.warning(f"Error reopening the channel, reconnecting: {e}")
+            self._close_connection()
+            return self.connect()
+
+    def _close_connection(self):
+        """Close the current connection, so the broker releases what it holds"""
+        try:
+            if self.connection and self.connection.is_open:
+                self.connection.close()
+        except Exception:
+            pass
+
     def disconnect(self):
         """Gracefully disconnect from RabbitMQ"""
+        self.management.close()
         try:
             if self.connection and not self.connection.is_closed:
                 self.connection.close()
@@ -85,22 +118,22 @@ class QueueAgent:
         except Exception as e:
             logger.error(f"Error disconnecting from RabbitMQ: {e}")
 
-    def list_all_queues_details(self):
+    def list_all_queues_details(self, columns=None, name_regex=None, use_cache=True):
         """
         List all queues in the RabbitMQ vhost specified for the parent.
 
         This connects to the RabbitMQ Management API to retrieve the list of queues.
+
+        Args:
+            columns: Optional list of queue attributes to return, all if not set.
+            name_regex: Optional regex the queue names must match.
+            use_cache: Whether a listing cached in the last few seconds may be returned.
         """
 
         try:
-            response = requests.get(
-                self.url,
-                auth=requests.auth.HTTPBasicAuth(
-                    self.rabbitmq_username, self.rabbitmq_password
-                ),
+            return self.management.list_queues(
+                columns=columns, name_regex=name_regex, use_cache=use_cache
             )
-            response.raise_for_status()
-            return response.json()
 
         except requests.exceptions.RequestException as e:
             logger.error(f"Error connecting to RabbitMQ Management API:\n{e}")
@@ -110,7 +143,9 @@ class QueueAgent:
         """
         List all queues in the RabbitMQ vhost specified for the parent.
         """
-        queues_details = self.list_all_queues_details()
+        queues_details = self.list_all_queues_details(columns=["name"])
+        if queues_details is None:
+            return None
 
         queue_names = [queue.get("name") for queue in queues_details]
         return queue_names
@@ -118,17 +153,28 @@ class QueueAgent:
     def create_queue(self, queue_name, arguments={}):
         """
         Create a queue in RabbitMQ if it does not exist.
+
+        Returns:
+            True if the queue exists with these arguments, False otherwise.
         """
         try:
             # Declare the queue (idempotent operation)
             self.channel.queue_declare(
                 queue=queue_name, arguments=arguments, durable=True
             )
+            self.management.invalidate(queue_name)
             logger.debug(f"Created queue: '{queue_name}'.")
             return True
+        except pika.exceptions.ChannelClosedByBroker as e:
+            # E.g. the queue exists with a different type or length limit, which
+            # closes the channel but not the connection, so retrying would fail again
+            logger.error(f"Error creating queue '{queue_name}': {e}")
+            self._reopen_channel()
+            return False
         except Exception as e:
             logger.warning(f"Error creating queue '{queue_name}': {e}")
             # Try to reconnect and get message again
+            self._close_connection()
             if self.connect():
                 logger.debug("Reconnected successfully.")
                 return self.create_queue(queue_name, arguments=arguments)
@@ -137,14 +183,62 @@ class QueueAgent:
 
         return False
 
-    def delete_queue(self, queue_name):
+    def delete_queue(self, queue_name, if_empty=False, if_unused=False):
         """
         Delete a queue in RabbitMQ if it exists.
+
+        Args:
+            queue_name: Name of the queue to delete.
+            if_empty: Only delete the queue if it has no messages.
+            if_unused: Only delete the queue if it has no consumers.
+
+        Returns:
+            True if the queue was deleted, False otherwise, see
+            delete_queue_outcome() for why it was not.
+        """
+        outcome = self.delete_queue_outcome(
+            queue_name, if_empty=if_empty, if_unused=if_unused
+        )
+        return outcome == "deleted"
+
+    def delete_queue_outcome(self, queue_name, if_empty=False, if_unused=False):
+        """
+        Delete a queue in RabbitMQ and tell what happened.
+
+        Args:
+            queue_name: Name of the queue to delete.
+            if_empty: Only delete the queue if it has no messages.
+            if_unused: Only delete the queue if it has no consumers.
+
+        Returns:
+            "deleted" if the queue was deleted, "kept" if it was not because
+            it is not empty or in use, "not_found" if it did not exist, or
+            "failed" if it could not be deleted.
         """
         try:
-            self.channel.queue_delete(queue=queue_name)
+            self.channel.queue_delete(
+                queue=queue_name, if_empty=if_empty, if_unused=if_unused
+            )
+            self.management.invalidate(queue_name)
             logger.debug(f"Deleted queue: '{queue_name}'.")
-            return True
+            return "deleted"
+        except pika.exceptions.ChannelClosedByBroker as e:
+            # This closes the channel but usually not the connection, and
+            # retrying would fail the same way
+            if not self._reopen_channel():
+                logger.error("Reconnection attempt from delete_queue() failed.")
+                return "failed"
+            self.management.invalidate(queue_name)
+            match e.reply_code:
+                case 406:
+                    logger.debug(f"Kept queue '{queue_name}', it is not empty or in use.")
+                    return "kept"
+                case 404:
+                    logger.debug(f"Queue '{queue_name}' was already deleted.")
+                    return "not_found"
+                case _:
+                    logger.warning(f"Error deleting queue '{queue_name}': {e}")
+                    return "failed"
         except Exception as e:
             logger.warning(f"Error deleting queue '{queue_name}': {e}")
 
@@ -154,11 +248,13 @@ class QueueAgent:
             )
             if self.connect():
                 logger.debug("Reconnected successfully.")
-                self.delete_queue(queue_name)
+                return self.delete_queue_outcome(
+                    queue_name, if_empty=if_empty, if_unused=if_unused
+                )
             else:
                 logger.error("Reconnection attempt from delete_queue() failed.")
 
-        return False
+        return "failed"
 
     def publish_message(self, queue_name, message_body):
         """
@@ -184,6 +280,10 @@ class QueueAgent:
                 f"Published message to vhost '{self.rabbitmq_vhost}', queue '{queue_name}'."
             )
             return True
+        except pika.exceptions.NackError:
+            # The queue is full, republishing would be rejected again
+            logger.warning(f"Queue '{queue_name}' rejected the message.")
+            return False
         except Exception as e:
             logger.warning(f"Error publishing message to queue '{queue_name}': {e}")
 
@@ -199,7 +299,7 @@ class QueueAgent:
 
         return False
 
-    def get_message_count(self, queue_name, message_type="ready"):
+    def get_message_count(self, queue_name, message_type="ready", use_cache=True):
         """
         Get the number of messages in a specified queue.
 
@@ -208,15 +308,7 @@ class QueueAgent:
         """
 
         try:
-            response = requests.get(
-                f"{self.url}/{queue_name}",
-                auth=requests.auth.HTTPBasicAuth(
-                    self.rabbitmq_username, self.rabbitmq_password
-                ),
-            )
-            response.raise_for_status()
-
-            data = response.json()
+            data = self.management.get_queue(queue_name, use_cache=use_cache)
         except Exception as e:
             logger.error(f"Failed to get message count: {e}")
             return None
@@ -235,17 +327,25 @@ class QueueAgent:
                 logger.error(f"Invalid message_type '{message_type}' specified.")
                 return None
 
-    def get_message_counts(self, queue_name):
+    def get_message_counts(self, queue_name, use_cache=True):
         """
         Get the counts of ready, unacked, and total messages in a specified queue.
 
+        All three counts are read from a single snapshot of the queue.
+
         Returns:
             A dict with keys 'ready', 'unacked', and 'total'.
         """
+        try:
+            data = self.management.get_queue(queue_name, use_cache=use_cache)
+        except Exception as e:
+            logger.error(f"Failed to get message counts: {e}")
+            return {"ready": None, "unacked": None, "total": None}
+
         return {
-            "ready": self.get_message_count(queue_name, message_type="ready"),
-            "unacked": self.get_message_count(queue_name, message_type="unacked"),
-            "total": self.get_message_count(queue_name, message_type="total"),
+            "ready": data.get("messages_ready", 0),
+            "unacked": data.get("messages_unacknowledged", 0),
+            "total": data.get("messages", 0),
         }
 
     def get_message(self, queue_name, auto_ack=False):
@@ -289,35 +389,163 @@ class QueueAgent:
 
         return None
 
-    def retrieve_all_messages_and_delete_queue(self, queue_name):
+    def drain_queue(
+        self,
+        queue_name,
+        sink,
+        expected_count=None,
+        prefetch_count=None,
+        ack_batch_size=None,
+        inactivity_timeout=None,
+    ):
+        """
+        Consume all messages of a queue and pass each one to a sink.
+
+        Messages are pushed by the broker up to prefetch_count at a time and
+        acknowledged in batches, so draining costs no per message round-trip.
+        A batch is only acknowledged after the sink handled its messages.
+
+        Args:
+            queue_name: Name of the queue to drain.
+            sink: Callable that receives each message body as a dict.
+            expected_count: Number of messages to drain. Read from the row_count
+                argument of the queue if not given, or from its message count.
+            prefetch_count: Number of unacknowledged messages the broker may push.
+            ack_batch_size: Number of messages acknowledged at once.
+            inactivity_timeout: Seconds to wait for a message before giving up.
+                These three default to the RABBITMQ_DRAIN_* settings.
+
+        Returns:
+            The number of messages drained.
+
+        Raises:
+            The exception raised by the sink, after the messages it did not
+            finish are returned to the queue.
+        """
+        prefetch_count = prefetch_count or config.RABBITMQ_DRAIN_PREFETCH
+        ack_batch_size = ack_batch_size or config.RABBITMQ_DRAIN_ACK_BATCH
+        inactivity_timeout = inactivity_timeout or config.RABBITMQ_DRAIN_INACTIVITY_TIMEOUT
+
+        if expected_count is None:
+            expected_count = self.get_expected_message_count(queue_name)
+        if expected_count is None:
+            expected_count = self.get_message_count(
+                queue_name, message_type="total", use_cache=False
+            )
+        if expected_count is None:
+            logger.warning(
+                f"Expected message count of queue '{queue_name}' is unknown, draining until it is idle."
+            )
+        elif expected_count == 0:
+            return 0
+
+        ack_batch_size = min(ack_batch_size, prefetch_count)
+        drained = 0
+        unacked = 0
+        last_delivery_tag = None
+        sink_failed = False
+
+        try:
+            self.channel.basic_qos(prefetch_count=prefetch_count)
+
+            try:
+                for method_frame, properties, body in self.channel.consume(
+                    queue_name, inactivity_timeout=inactivity_timeout
+                ):
+                    # No message arrived within the inactivity timeout
+                    if method_frame is None:
+                        break
+
+                    try:
+                        message = json.loads(body)
+                        message["delivery_tag"] = method_frame.delivery_tag
+                        sink(message)
+                    except Exception:
+                        sink_failed = True
+                        if self.channel.is_open:
+                            # Acknowledge the messages the sink handled, so they
+                            # are not drained twice, and return the failed one
+                            if unacked:
+                                self.channel.basic_ack(last_delivery_tag, multiple=True)
+                            self.channel.basic_nack(
+                                method_frame.delivery_tag, requeue=True
+                            )
+                        raise
+
+                    # The last message the sink handled
+                    last_delivery_tag = method_frame.delivery_tag
+                    unacked += 1
+                    drained += 1
+
+                    if unacked >= ack_batch_size:
+                        self.channel.basic_ack(last_delivery_tag, multiple=True)
+                        unacked = 0
+
+                    if expected_count is not None and drained >= expected_count:
+                        break
+
+                if unacked:
+                    self.channel.basic_ack(last_delivery_tag, multiple=True)
+            finally:
+                if self.channel.is_open:
+                    # Return the prefetched messages the sink did not get to the queue
+                    self.channel.cancel()
+                    # Restore the default of one unacknowledged message at a time
+                    self.channel.basic_qos(prefetch_count=1)
+        except (
+            pika.exceptions.AMQPChannelError,
+            pika.exceptions.AMQPConnectionError,
+        ) as e:
+            logger.error(f"Error draining queue '{queue_name}': {e}")
+            # Close the old connection first, so the broker requeues the messages
+            # its consumer still holds, then start over with a new one
+            try:
+                if self.connection and self.connection.is_open:
+                    self.connection.close()
+            except Exception:
+                pass
+            if self.connect():
+                logger.debug("Reconnected successfully.")
+            else:
+                logger.error("Reconnection attempt from drain_queue() failed.")
+
+            # The caller has to know its sink did not get every message
+            if sink_failed:
+                raise
+
+        if expected_count is not None and drained < expected_count:
+            logger.warning(
+                f"Drained {drained} of the {expected_count} expected messages from queue '{queue_name}'."
+            )
+        else:
+            logger.debug(f"Drained {drained} messages from queue '{queue_name}'.")
+
+        return drained
+
+    def retrieve_all_messages_and_delete_queue(self, queue_name, sink=None):
         """
         Retrieve all messages from the specified queue.
 
         This is used to drain the queue when generating result files.
 
-        We have a timeout of 5 minutes to avoid infinite loops.
+        The queue is drained by a prefetching consumer until the expected number
+        of messages is retrieved or no message arrives within the inactivity
+        timeout, see drain_queue().
 
         Args:
             queue_name: Name of the queue to retrieve from.
+            sink: Optional callable that receives each message body as a dict,
+                so the messages are streamed instead of collected in a list.
 
         Returns:
-            A list of message bodies as dicts.
+            A list of message bodies as dicts, or the number of messages
+            passed to the sink if one is given.
         """
+        if sink:
+            return self.drain_queue(queue_name, sink)
+
         messages_retrieved = []
-        start_time = time.time()
-
-        # While messages remain in the queue and elapsed time is less than 5 minutes, keep fetching
-        while (
-            self.get_message_count(queue_name) > len(messages_retrieved)
-            and (time.time() - start_time) < 300
-        ):
-            message = self.get_message(queue_name, auto_ack=True)
-            if message:
-                messages_retrieved.append(message)
-            else:
-                logger.error(
-                    f"Expected more messages in queue '{queue_name}' but failed to retrieve."
-                )
+        self.drain_queue(queue_name, messages_retrieved.append)
 
         logger.debug(
             f"Retrieved all {len(messages_retrieved)} messages from queue {queue_name}."
@@ -401,7 +629,7 @@ class QueueAgent:
 
         return False
 
-    def get_queue_props(self, queue_name):
+    def get_queue_props(self, queue_name, use_cache=True):
         """
         List all attributes of a queue in the RabbitMQ vhost specified for the parent.
 
@@ -409,14 +637,7 @@ class QueueAgent:
         """
 
         try:
-            response = requests.get(
-                f"{self.url}/{queue_name}",
-                auth=requests.auth.HTTPBasicAuth(
-                    self.rabbitmq_username, self.rabbitmq_password
-                ),
-            )
-            response.raise_for_status()
-            return response.json()
+            return self.management.get_queue(queue_name, use_cache=use_cache)
 
         except requests.exceptions.RequestException as e:
             logger.error(f"Error connecting to RabbitMQ Management API:\n{e}")
@@ -0,0 +1,145 @@
+import copy
+import threading
+import time
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app import config
+
+
+class ManagementClient:
+    """
+    Client for the RabbitMQ Management API of a single vhost.
+
+    Requests go through one persistent HTTP session with keep-alive, timeouts
+    and retries. Responses are cached for a short time, so reading several
+    fields of the same queue costs a single request.
+    """
+
+    def __init__(
+        self,
+        rabbitmq_host,
+        rabbitmq_vhost,
+        rabbitmq_username,
+        rabbitmq_password,
+        timeout=None,
+        cache_ttl=None,
+    ):
+        self.url = f"https://{rabbitmq_host}/api/queues/{quote(rabbitmq_vhost, safe='')}"
+        self.timeout = config.RABBITMQ_MANAGEMENT_TIMEOUT if timeout is None else timeout
+        self.cache_ttl = (
+            config.RABBITMQ_MANAGEMENT_CACHE_TTL if cache_ttl is None else cache_ttl
+        )
+
+        self.session = requests.Session()
+        self.session.auth = requests.auth.HTTPBasicAuth(
+            rabbitmq_username, rabbitmq_password
+        )
+        retries = Retry(
+            total=2,
+            backoff_factor=0.2,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=["GET"],
+        )
+        self.session.mount("https://", HTTPAdapter(max_retries=retries))
+
+        # Maps a request to the time it expires at and its response
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+
+    def _get(self, url, params=None, use_cache=True):
+        """
+        GET a Management API url and return its JSON, from the cache if it is fresh.
+
+        Raises:
+            requests.exceptions.RequestException if the request fails.
+        """
+        cache_key = (url, tuple(sorted((params or {}).items())))
+
+        if use_cache and self.cache_ttl > 0:
+            with self._cache_lock:
+                cached = self._cache.get(cache_key)
+            if cached and cached[0] > time.monotonic():
+                # Each caller gets its own copy, so changing it cannot change the cache
+                return copy.deepcopy(cached[1])
+
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+
+        if self.cache_ttl > 0:
+            now = time.monotonic()
+            with self._cache_lock:
+                # Evict the expired responses, every queue and page has its own
+                self._cache = {
+                    key: value for key, value in self._cache.items() if value[0] > now
+                }
+                self._cache[cache_key] = (now + self.cache_ttl, copy.deepcopy(data))
+
+        return data
+
+    def invalidate(self, queue_name=None):
+        """
+        Drop the cached responses of a queue, or the whole cache if no queue is given.
+
+        Queue listings are always dropped, since they include every queue.
+        """
+        with self._cache_lock:
+            if queue_name is None:
+                self._cache = {}
+                return
+            queue_url = f"{self.url}/{quote(queue_name, safe='')}"
+            self._cache = {
+                key: value
+                for key, value in self._cache.items()
+                if key[0] not in (queue_url, self.url)
+            }
+
+    def get_queue(self, queue_name, use_cache=True):
+        """
+        Get a snapshot of all the attributes of a queue.
+        """
+        return self._get(
+            f"{self.url}/{quote(queue_name, safe='')}", use_cache=use_cache
+        )
+
+    def list_queues(self, columns=None, name_regex=None, page_size=500, use_cache=True):
+        """
+        List the queues of the vhost in bulk.
+
+        Args:
+            columns: Optional list of attributes to return for each queue,
+                e.g. ["name", "messages", "arguments"]. All are returned if not set.
+            name_regex: Optional regex the queue names must match. The listing
+                is paginated in this case, since the API only filters pages.
+            page_size: Number of queues per page when filtering by name.
+            use_cache: Whether a fresh cached listing may be returned.
+
+        Returns:
+            A list of queue dicts.
+        """
+        params = {}
+        if columns:
+            params["columns"] = ",".join(columns)
+
+        if not name_regex:
+            return self._get(self.url, params=params, use_cache=use_cache)
+
+        params.update({"name": name_regex, "use_regex": "true", "page_size": page_size})
+        queues = []
+        page = 1
+        while True:
+            data = self._get(
+                self.url, params={**params, "page": page}, use_cache=use_cache
+            )
+            queues.extend(data.get("items", []))
+            if page >= data.get("page_count", 1):
+                return queues
+            page += 1
+
+    def close(self):
+        """Close the HTTP session"""
+        self.session.close()
@@ -1,6 +1,6 @@
 import requests
 import asyncio
-from app.config import UPTIME_MONITOR, POLLING_INTERVAL
+from app import config
 from app.utilities.logging import logger
 
 
@@ -8,9 +8,9 @@ from app.utilities.logging import logger
 async def ping_uptime_monitor():
     while True:
         try:
-            requests.get(UPTIME_MONITOR)
+            requests.get(config.UPTIME_MONITOR)
         except Exception as e:
             logger.error(f"Error while sending heartbeat to uptime monitor: {e}")
         finally:
             # this is not blocking execution like time.sleep() does
-            await asyncio.sleep(POLLING_INTERVAL)
+            await asyncio.sleep(config.POLLING_INTERVAL)
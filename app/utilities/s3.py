@@ -1,16 +1,22 @@
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from app.config import (
-    S3_BUCKET_NAME,
-    s3,
-)
+from app import config
 from app.utilities.logging import logger
+from app.utilities.services import get_s3
+
+# Bytes read from a response body at a time
+_CHUNK_SIZE = 1024 * 1024
 
 
 # Returns the list of newly accepted files
 def list_files(prefix=""):
     # Check if there are any new files in the S3 bucket
-    s3_response = s3.meta.client.list_objects_v2(Bucket=S3_BUCKET_NAME, Prefix=prefix)
+    s3_response = get_s3().meta.client.list_objects_v2(
+        Bucket=config.S3_BUCKET_NAME, Prefix=prefix
+    )
 
     return s3_response.get("Contents", [])
 
@@ -18,24 +24,147 @@ def list_files(prefix=""):
 def delete_file(key):
     objects = [{"Key": key}]
     try:
-        s3.Bucket(S3_BUCKET_NAME).delete_objects(Delete={"Objects": objects})
+        get_s3().Bucket(config.S3_BUCKET_NAME).delete_objects(Delete={"Objects": objects})
     except Exception as e:
         logger.error(f"Error deleting file: {e}", extra={"file_key": key})
 
 
-def download_file(key, local_name):
-    file_path = os.path.join(os.path.dirname(__file__), local_name)
+def _copy_body(body, file, length=None, cancelled=None):
+    # Copy a response body to a file, up to length bytes if given
+    remaining = length
+    while remaining is None or remaining > 0:
+        if cancelled is not None and cancelled.is_set():
+            return
+        chunk = body.read(_CHUNK_SIZE if remaining is None else min(_CHUNK_SIZE, remaining))
+        if not chunk:
+            return
+        file.write(chunk)
+        if remaining is not None:
+            remaining -= len(chunk)
+
+
+def _download_range(key, etag, local_path, start, end, cancelled):
+    if cancelled.is_set():
+        return
+
+    # Pinned to the ETag so a file replaced meanwhile fails instead of mixing versions
+    response = get_s3().meta.client.get_object(
+        Bucket=config.S3_BUCKET_NAME, Key=key, Range=f"bytes={start}-{end}", IfMatch=etag
+    )
+    with open(local_path, "r+b") as file:
+        file.seek(start)
+        _copy_body(response["Body"], file, cancelled=cancelled)
+
+
+def download_file(key, local_path):
+    """
+    Download a file, as concurrent byte ranges if it is large.
+
+    The file is requested in a single stream. From S3_DOWNLOAD_THRESHOLD
+    bytes, only its first S3_DOWNLOAD_PART_SIZE bytes are read from that
+    stream, while S3_DOWNLOAD_CONCURRENCY threads fetch the other parts, each
+    part written at its offset of a preallocated local file. A failed part
+    cancels the parts that have not finished.
+
+    Args:
+        key: Key of the file in the bucket.
+        local_path: Path to write the file to.
+
+    Returns:
+        Dict with the size, the number of parts, the wall time and the
+        throughput of the download, or None if it failed.
+    """
+    start_time = time.perf_counter()
 
     try:
-        s3.Bucket(S3_BUCKET_NAME).download_file(key, file_path)
+        os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+        response = get_s3().meta.client.get_object(
+            Bucket=config.S3_BUCKET_NAME, Key=key
+        )
+        size = response["ContentLength"]
+        part_size = max(config.S3_DOWNLOAD_PART_SIZE, 1)
+
+        if (
+            size < config.S3_DOWNLOAD_THRESHOLD
+            or size <= part_size
+            or config.S3_DOWNLOAD_CONCURRENCY <= 1
+        ):
+            parts = 1
+            with open(local_path, "wb") as file:
+                _copy_body(response["Body"], file)
+        else:
+            with open(local_path, "wb") as file:
+                file.truncate(size)
+
+            ranges = [
+                (start, min(start + part_size, size) - 1)
+                for start in range(part_size, size, part_size)
+            ]
+            parts = len(ranges) + 1
+            cancelled = threading.Event()
+            executor = ThreadPoolExecutor(config.S3_DOWNLOAD_CONCURRENCY)
+            try:
+                futures = [
+                    executor.submit(
+                        _download_range,
+                        key,
+                        response["ETag"],
+                        local_path,
+                        start,
+                        end,
+                        cancelled,
+                    )
+                    for start, end in ranges
+                ]
+
+                # The first part is read from the stream that is already open
+                with open(local_path, "r+b") as file:
+                    _copy_body(response["Body"], file, length=part_size)
+                response["Body"].close()
+
+                for future in as_completed(futures):
+                    future.result()
+            except Exception:
+                # Stop the parts in progress and drop the ones not started
+                cancelled.set()
+                raise
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
     except Exception as e:
         logger.error(f"Error downloading file: {e}", extra={"file_key": key})
+        # Do not leave a partial file behind
+        if os.path.exists(local_path):
+            os.remove(local_path)
+        return None
+
+    seconds = time.perf_counter() - start_time
+    return {
+        "bytes": size,
+        "parts": parts,
+        "seconds": seconds,
+        "bytes_per_second": size / seconds if seconds else 0.0,
+    }
+
+
+def upload_file(local_path, key):
+    """
+    Upload a local file to the bucket.
+
+    Returns:
+        True if the file was uploaded, False otherwise.
+    """
+    try:
+        get_s3().meta.client.upload_file(local_path, config.S3_BUCKET_NAME, key)
+        return True
+    except Exception as e:
+        logger.error(f"Error uploading file: {e}", extra={"file_key": key})
+        return False
 
 
 def move_file(source_key, destination_key):
-    copy_source = {"Bucket": S3_BUCKET_NAME, "Key": source_key}
+    copy_source = {"Bucket": config.S3_BUCKET_NAME, "Key": source_key}
     try:
-        s3.meta.client.copy(copy_source, S3_BUCKET_NAME, destination_key)
+        get_s3().meta.client.copy(copy_source, config.S3_BUCKET_NAME, destination_key)
         delete_file(source_key)
     except Exception as e:
         logger.error(f"Error moving file: {e}", extra={"file_key": key})
@@ -0,0 +1,142 @@
+import threading
+
+from app import config
+
+
+class ServiceRegistry:
+    """
+    Registry of the shared clients of the app, each built on first use.
+
+    Nothing is connected or imported at startup, so the app is ready to take
+    work right away and a misconfigured dependency only fails where it is used.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, factory):
+        """
+        Register the factory that builds a service when it is first requested.
+        """
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+
+    def get(self, name):
+        """
+        Get a service, building it if this is the first time it is requested.
+        """
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+
+        with self._lock:
+            if name not in self._instances:
+                self._instances[name] = self._factories[name]()
+            return self._instances[name]
+
+    def is_built(self, name):
+        return name in self._instances
+
+    def built(self):
+        """
+        List the names of the services that have been built so far.
+        """
+        return list(self._instances)
+
+    def reset(self, name=None):
+        """
+        Drop a built service, or all of them, so they are built again on next use.
+        """
+        with self._lock:
+            if name is None:
+                self._instances = {}
+            else:
+                self._instances.pop(name, None)
+
+
+def _build_s3():
+    import boto3
+    from botocore.config import Config
+
+    return boto3.resource(
+        "s3",
+        endpoint_url=config.S3_ENDPOINT,
+        aws_access_key_id=config.S3_KEY,
+        aws_secret_access_key=config.S3_SECRET,
+        # Enough connections for every part of a download to have its own
+        config=Config(max_pool_connections=max(10, config.S3_DOWNLOAD_CONCURRENCY)),
+    )
+
+
+def _build_db_engine():
+    from sqlalchemy import create_engine
+
+    return create_engine(
+        config.DATABASE_CONNECTION_STRING,
+        pool_pre_ping=True,
+        pool_size=config.DATABASE_POOL_SIZE,
+        max_overflow=config.DATABASE_MAX_OVERFLOW,
+        pool_timeout=config.DATABASE_POOL_TIMEOUT,
+        pool_recycle=config.DATABASE_POOL_RECYCLE,
+    )
+
+
+def _build_db_sessionmaker():
+    from sqlalchemy.orm import sessionmaker
+
+    # Sessions are created per task, objects stay usable after their session closes
+    return sessionmaker(bind=get_db_engine(), expire_on_commit=False)
+
+
+def _build_queue_agent():
+    from app.utilities.rabbitmq import QueueAgent
+
+    return QueueAgent()
+
+
+def _build_loki_handler():
+    import logging_loki
+
+    return logging_loki.LokiHandler(
+        url=f"{config.LOKI_HOST}/loki/api/v1/push",
+        tags={"application": "maillistshield", "service": config.SERVICE_NAME},
+        auth=(config.LOKI_USER, config.LOKI_PASSWORD),
+        version="1",
+    )
+
+
+services = ServiceRegistry()
+services.register("s3", _build_s3)
+services.register("db_engine", _build_db_engine)
+services.register("db_sessionmaker", _build_db_sessionmaker)
+services.register("queue_agent", _build_queue_agent)
+# The reaper gets its own connection, the publishing one is used from another thread
+services.register("reaper_queue_agent", _build_queue_agent)
+services.register("loki_handler", _build_loki_handler)
+
+
+def get_s3():
+    return services.get("s3")
+
+
+def get_db_engine():
+    return services.get("db_engine")
+
+
+def get_db_sessionmaker():
+    return services.get("db_sessionmaker")
+
+
+def get_queue_agent():
+    return services.get("queue_agent")
+
+
+def get_reaper_queue_agent():
+    return services.get("reaper_queue_agent")
+
+
+def get_loki_handler():
+    return services.get("loki_handler")
@@ -0,0 +1,81 @@
+# Startup time benchmark
+#   python benchmarks/startup.py [--runs 10]
+#
+# Measures how long a fresh interpreter takes to import the app, which is what
+# an autoscaled replica pays before it can take work, and checks that no client
+# (S3, database, RabbitMQ, Loki) is built during the import.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_APP = """
+import time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+from app.utilities.services import services
+print(elapsed, ",".join(services.built()))
+"""
+
+IMPORT_NOTHING = """
+print(0.0)
+"""
+
+
+def measure(snippet, runs):
+    """
+    Run a snippet in fresh interpreters.
+
+    Returns:
+        A tuple of the import times the snippet reports, the wall times of the
+        processes, both in seconds, and the names of the services built.
+    """
+    import_times = []
+    process_times = []
+    built = set()
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", snippet],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.split()
+        process_times.append(time.perf_counter() - start)
+        import_times.append(float(output[0]))
+        if len(output) > 1:
+            built.update(output[1].split(","))
+    return import_times, process_times, built
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app's startup time.")
+    parser.add_argument("--runs", type=int, default=10, help="Number of fresh imports")
+    args = parser.parse_args()
+
+    _, baseline, _ = measure(IMPORT_NOTHING, args.runs)
+    import_times, process_times, built = measure(IMPORT_APP, args.runs)
+
+    print(f"Runs:             {args.runs}")
+    print(
+        f"import app:       median {statistics.median(import_times) * 1000:.1f} ms, "
+        f"min {min(import_times) * 1000:.1f} ms, max {max(import_times) * 1000:.1f} ms"
+    )
+    print(f"Process:          median {statistics.median(process_times) * 1000:.1f} ms")
+    print(f"Bare interpreter: median {statistics.median(baseline) * 1000:.1f} ms")
+    print(f"Built clients:    {', '.join(sorted(built)) or 'none'}")
+
+    # Clients must be built on first use, not while importing
+    if built:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
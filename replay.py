@@ -0,0 +1,38 @@
+import argparse
+import logging
+import os
+
+# Replay the publisher on local CSV files without S3, Postgres, RabbitMQ or Loki:
+#   python replay.py path/to/file_or_directory [--output-dir tmp/replay]
+
+parser = argparse.ArgumentParser(
+    description="Run the file to validation queue publisher on local CSV files."
+)
+parser.add_argument("path", help="A CSV file or a directory of CSV files")
+parser.add_argument(
+    "--output-dir",
+    default="tmp/replay",
+    help="Directory the queue files, the local database, the pre-validation sidecars and the profiles are written to",
+)
+parser.add_argument("--log-level", default="INFO", help="Log level of the app logger")
+args = parser.parse_args()
+
+output_dir = os.path.abspath(args.output_dir)
+os.makedirs(output_dir, exist_ok=True)
+
+# The app reads its settings on first use, a replay only needs the database,
+# which always is a local one, Loki is never used and the timezone defaults to UTC.
+# Everything the replay writes goes to the output directory
+os.environ["DATABASE_CONNECTION_STRING"] = (
+    f"sqlite:///{os.path.join(output_dir, 'replay.db')}"
+)
+os.environ["PREVALIDATION_SIDECAR_DIR"] = os.path.join(output_dir, "prevalidation")
+os.environ["PROFILE_DIR"] = os.path.join(output_dir, "profiles")
+os.environ["LOKI_HOST"] = ""
+os.environ.setdefault("TIMEZONE", "UTC")
+
+from app.replay import run_replay, print_report  # noqa: E402
+
+logging.getLogger("mls").setLevel(args.log_level.upper())
+
+print_report(run_replay(args.path, output_dir))
@@ -0,0 +1,81 @@
+from app.utilities import not_ready_cache as not_ready_cache_module
+from app.utilities.not_ready_cache import NotReadyCache
+
+ITEM = {"Key": "validation/in-progress/a.csv", "ETag": '"abc"', "LastModified": 1}
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def _cache(monkeypatch, ttl=10, max_ttl=40):
+    clock = _Clock()
+    monkeypatch.setattr(not_ready_cache_module.time, "monotonic", clock.monotonic)
+    return NotReadyCache(ttl=ttl, max_ttl=max_ttl), clock
+
+
+def test_not_ready_until_ttl_expires(monkeypatch):
+    cache, clock = _cache(monkeypatch)
+
+    assert not cache.is_not_ready(ITEM)
+    cache.mark_not_ready(ITEM)
+    assert cache.is_not_ready(ITEM)
+
+    clock.now += 10
+    assert not cache.is_not_ready(ITEM)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_changed_object_is_looked_up_again(monkeypatch):
+    cache, _ = _cache(monkeypatch)
+    cache.mark_not_ready(ITEM)
+
+    assert not cache.is_not_ready({**ITEM, "ETag": '"def"'})
+    assert not cache.is_not_ready({**ITEM, "LastModified": 2})
+
+
+def test_ttl_backs_off_up_to_max(monkeypatch):
+    cache, clock = _cache(monkeypatch)
+
+    for expected_ttl in (10, 20, 40, 40):
+        cache.mark_not_ready(ITEM)
+        clock.now += expected_ttl - 1
+        assert cache.is_not_ready(ITEM)
+        clock.now += 1
+        assert not cache.is_not_ready(ITEM)
+
+
+def test_backoff_starts_over_for_a_new_version(monkeypatch):
+    cache, clock = _cache(monkeypatch)
+    cache.mark_not_ready(ITEM)
+    cache.mark_not_ready(ITEM)
+
+    changed = {**ITEM, "ETag": '"def"'}
+    cache.mark_not_ready(changed)
+    clock.now += 10
+    assert not cache.is_not_ready(changed)
+
+
+def test_forget_and_retain(monkeypatch):
+    cache, _ = _cache(monkeypatch)
+    other = {**ITEM, "Key": "validation/in-progress/b.csv"}
+    cache.mark_not_ready(ITEM)
+    cache.mark_not_ready(other)
+
+    cache.retain([other["Key"]])
+    assert len(cache) == 1
+    assert not cache.is_not_ready(ITEM)
+
+    cache.forget(other["Key"])
+    assert len(cache) == 0
+
+
+def test_zero_ttl_disables_the_cache(monkeypatch):
+    cache, _ = _cache(monkeypatch, ttl=0, max_ttl=300)
+    cache.mark_not_ready(ITEM)
+
+    assert not cache.is_not_ready(ITEM)
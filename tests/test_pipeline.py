@@ -0,0 +1,69 @@
+import asyncio
+import tracemalloc
+
+from app.pipeline import PipelineStage, run_pipeline
+from app.utilities.profiling import ResourceAccountant
+
+
+def test_items_pass_through_every_stage():
+    seen = []
+
+    async def double(item):
+        return item * 2
+
+    async def collect(item):
+        seen.append(item)
+        return item
+
+    stats = asyncio.run(
+        run_pipeline(
+            [1, 2, 3],
+            [PipelineStage("double", double, workers=2), PipelineStage("collect", collect)],
+        )
+    )
+
+    assert sorted(seen) == [2, 4, 6]
+    assert stats["double"]["items"] == 3
+    assert stats["collect"]["items"] == 3
+    assert 0 <= stats["collect"]["utilization"] <= 1
+
+
+def test_dropped_items_are_passed_to_on_drop():
+    dropped = []
+
+    async def skip_odd(item):
+        return item if item % 2 == 0 else None
+
+    async def fail_on_four(item):
+        if item == 4:
+            raise RuntimeError("failed")
+        return item
+
+    stats = asyncio.run(
+        run_pipeline(
+            [1, 2, 3, 4],
+            [PipelineStage("skip", skip_odd), PipelineStage("fail", fail_on_four)],
+            on_drop=dropped.append,
+        )
+    )
+
+    assert sorted(dropped) == [1, 3, 4]
+    assert stats["fail"]["items"] == 2
+
+
+def test_dropped_accountant_stops_allocation_tracing():
+    async def start(name):
+        return {"accountant": ResourceAccountant(name, track_allocations=True)}
+
+    async def fail(item):
+        raise RuntimeError("failed")
+
+    asyncio.run(
+        run_pipeline(
+            ["a.csv"],
+            [PipelineStage("start", start), PipelineStage("fail", fail)],
+            on_drop=lambda item: item["accountant"].finish(),
+        )
+    )
+
+    assert not tracemalloc.is_tracing()
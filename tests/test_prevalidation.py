@@ -0,0 +1,38 @@
+from app.utilities.prevalidation import prevalidate_emails
+
+
+def test_valid_emails_pass():
+    emails = [
+        "user@example.com",
+        " first.last@mail.example.co.uk ",
+        "ü@bücher.de",
+        "a@example.xn--p1ai",
+    ]
+
+    assert prevalidate_emails(emails) == ["", "", "", ""]
+
+
+def test_rejection_reasons():
+    emails = [
+        "",
+        None,
+        "a" * 250 + "@example.com",
+        "user.example.com",
+        "user@@example.com",
+        "us er@example.com",
+        ".user@example.com",
+        "user@-example.com",
+        "user@example",
+    ]
+
+    assert prevalidate_emails(emails) == [
+        "empty",
+        "empty",
+        "too_long",
+        "missing_at",
+        "multiple_at",
+        "illegal_characters",
+        "invalid_local_part",
+        "invalid_domain",
+        "invalid_domain",
+    ]
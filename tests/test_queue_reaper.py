@@ -0,0 +1,111 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app import config
+from app import queue_reaper
+from app.queue_reaper import reap_queues_once, select_queues_to_reap
+
+NOW = datetime.now(timezone.utc)
+# Older RabbitMQ versions report naive UTC times, newer ones ISO 8601 times
+IDLE = (NOW - timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+RECENT = (NOW - timedelta(minutes=1)).isoformat()
+
+JOB_STATUSES = {
+    "queued": "file_queued",
+    "finished": "completed",
+    "errored": "error_validation",
+}
+
+
+def _queue(name, jobuid=None, messages=0, consumers=0, idle_since=None):
+    return {
+        "name": name,
+        "messages": messages,
+        "consumers": consumers,
+        "idle_since": idle_since,
+        "arguments": {"jobuid": jobuid} if jobuid else {},
+    }
+
+
+QUEUES = [
+    _queue("batch_validation_finished", "finished", messages=10, consumers=1),
+    _queue("batch_validation_errored", "errored", messages=10),
+    _queue("batch_validation_idle", "queued", idle_since=IDLE),
+    _queue("batch_validation_recent", "queued", idle_since=RECENT),
+    _queue("batch_validation_busy", "queued", messages=5, idle_since=IDLE),
+    _queue("batch_validation_consumed", "queued", consumers=1, idle_since=IDLE),
+    _queue("batch_validation_orphaned", "missing", idle_since=IDLE),
+    _queue("batch_validation_unknown_idle", "queued"),
+    _queue("results_finished", "finished"),
+]
+
+
+def _configure(monkeypatch):
+    monkeypatch.setitem(config._values, "QUEUE_REAPER_FINISHED_STATUSES", "completed")
+    monkeypatch.setitem(config._values, "QUEUE_REAPER_IDLE_SECONDS", 3600)
+
+
+def test_select_queues_to_reap(monkeypatch):
+    _configure(monkeypatch)
+
+    assert select_queues_to_reap(QUEUES, JOB_STATUSES, now=NOW) == [
+        ("batch_validation_finished", "job_finished"),
+        ("batch_validation_errored", "job_errored"),
+        ("batch_validation_idle", "empty_idle"),
+        ("batch_validation_orphaned", "orphaned"),
+    ]
+
+
+class _FakeQueueAgent:
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.deleted = []
+
+    def list_all_queues_details(self, columns=None, name_regex=None, use_cache=True):
+        return QUEUES
+
+    def delete_queue_outcome(self, queue_name, if_empty=False, if_unused=False):
+        self.deleted.append((queue_name, if_empty, if_unused))
+        return self.outcomes.get(queue_name, "deleted")
+
+
+def _reap(monkeypatch, queue_agent, dry_run):
+    _configure(monkeypatch)
+
+    async def get_job_statuses(uids):
+        return JOB_STATUSES
+
+    monkeypatch.setattr(queue_reaper, "get_reaper_queue_agent", lambda: queue_agent)
+    monkeypatch.setattr(queue_reaper, "get_job_statuses_by_uid_async", get_job_statuses)
+    return asyncio.run(reap_queues_once(dry_run=dry_run))
+
+
+def test_dry_run_deletes_nothing(monkeypatch):
+    queue_agent = _FakeQueueAgent({})
+
+    metrics = _reap(monkeypatch, queue_agent, dry_run=True)
+
+    assert queue_agent.deleted == []
+    assert metrics["would_reap"] == 4
+    assert metrics["would_reap_orphaned"] == 1
+
+
+def test_outcomes_are_counted_apart(monkeypatch):
+    queue_agent = _FakeQueueAgent(
+        {
+            "batch_validation_idle": "kept",
+            "batch_validation_orphaned": "not_found",
+            "batch_validation_errored": "failed",
+        }
+    )
+
+    metrics = _reap(monkeypatch, queue_agent, dry_run=False)
+
+    # Idle queues are only deleted if they are still empty and unused
+    assert ("batch_validation_idle", True, True) in queue_agent.deleted
+    assert ("batch_validation_finished", False, False) in queue_agent.deleted
+    assert metrics["reaped"] == 1
+    assert metrics["reaped_job_finished"] == 1
+    assert metrics["kept"] == 1
+    assert metrics["gone"] == 1
+    assert metrics["errors"] == 1
@@ -0,0 +1,55 @@
+import pytest
+
+from app import config
+from app.utilities.queue_topology import (
+    assign_shards,
+    get_shard_count,
+    get_shard_queue_name,
+    validate_shard_strategy,
+)
+
+
+def test_range_shards_are_contiguous_and_balanced():
+    shards = assign_shards([f"user{i}@example.com" for i in range(10)], 3, "range")
+
+    assert shards == sorted(shards)
+    assert [shards.count(i) for i in range(3)] == [4, 3, 3]
+
+
+def test_hash_shards_are_stable_and_ignore_case():
+    emails = ["A@example.com", "a@example.com ", None, "b@example.com"]
+
+    shards = assign_shards(emails, 4, "hash")
+
+    assert shards == assign_shards(emails, 4, "hash")
+    assert shards[0] == shards[1]
+    assert all(0 <= shard < 4 for shard in shards)
+
+
+def test_single_shard():
+    assert assign_shards(["a@example.com", "b@example.com"], 1, "hash") == [0, 0]
+
+
+def test_unknown_strategy_is_rejected(monkeypatch):
+    with pytest.raises(ValueError):
+        assign_shards(["a@example.com", "b@example.com"], 2, "random")
+
+    monkeypatch.setitem(config._values, "QUEUE_SHARD_STRATEGY", "random")
+    with pytest.raises(ValueError):
+        validate_shard_strategy()
+
+
+def test_shard_count(monkeypatch):
+    monkeypatch.setitem(config._values, "QUEUE_SHARD_ROW_THRESHOLD", 100)
+    monkeypatch.setitem(config._values, "QUEUE_SHARD_COUNT", 4)
+
+    assert get_shard_count(99) == 1
+    assert get_shard_count(100) == 4
+
+
+def test_shard_queue_name():
+    assert get_shard_queue_name("batch_validation_a_csv", 0, 1) == "batch_validation_a_csv"
+    assert (
+        get_shard_queue_name("batch_validation_a_csv", 2, 4)
+        == "batch_validation_a_csv_shard_2"
+    )